@@ -4,42 +4,30 @@ Download all Axiom platemap and biochem metadata.
 
 """  # noqa: CPY001, INP001
 
-import re
-import os
-
-from sh import aws
-from pathlib import Path
+from download import build_manifest, download_all, open_location
 
 
 def main() -> None:
     """Download metadata.
 
-    Read in index file, download data.
+    Build a manifest of the metadata files of each batch and download them.
 
     """
     aws_path = "s3://cellpainting-gallery/cpg0037-oasis/axiom/workspace/metadata"
     local_meta = "../1_snakemake/inputs/metadata"
     batches = ["prod_25", "prod_26", "prod_27", "prod_30"]
 
-    os.makedirs(f"{local_meta}/metadata", exist_ok=True)
-    os.makedirs(f"{local_meta}/biochem", exist_ok=True)
-
     # get metadata (both biochem.parquet and metadata.parquet)
+    backend, prefix = open_location(aws_path)
+    rules = {
+        r"(?P<plate>plate_\d{8})/metadata\.parquet": f"{local_meta}/metadata/metadata_{{plate}}.parquet",
+        r"(?P<plate>plate_\d{8})/biochem\.parquet": f"{local_meta}/biochem/biochem_{{plate}}.parquet",
+    }
+    manifest = []
     for batch in batches:
-        batch_path = f"{aws_path}/{batch}/"
-        aws_output = aws("s3", "ls", batch_path)
-        plates = re.findall(r"plate_\d{8}", aws_output)
-
-        for plate in plates:
-            metadata_file = Path(f"{local_meta}/metadata/metadata_{plate}.parquet")
-            biochem_file = Path(f"{local_meta}/biochem/biochem_{plate}.parquet")
-
-            # only download if the files doesn't already exist
-            if not metadata_file.exists():
-                aws("s3", "cp", f"{batch_path}{plate}/metadata.parquet", str(metadata_file))
+        manifest += build_manifest(backend, f"{prefix}/{batch}/", rules)
 
-            if not biochem_file.exists():
-                aws("s3", "cp", f"{batch_path}{plate}/biochem.parquet", str(biochem_file))
+    download_all(backend, manifest, f"{local_meta}/manifest.json")
 
 
 if __name__ == "__main__":
@@ -4,15 +4,13 @@ Use CPG index to download all Axiom CPCNN profiles.
 
 """  # noqa: CPY001, INP001
 
-import re
-
-from sh import aws
+from download import build_manifest, download_all, open_location
 
 
 def main() -> None:
     """Download data.
 
-    Read in index file, download data.
+    Build a manifest of the CPCNN profiles of each batch and download them.
 
     """
     aws_path = "s3://cellpainting-gallery/cpg0037-oasis/axiom/workspace_dl/profiles/cpcnn_zenodo_7114558"
@@ -20,14 +18,14 @@ def main() -> None:
 
     prof_dir = "../1_snakemake/inputs/profiles/cpcnn/plates"
 
-    # get Dino embedding paths
+    # get CPCNN embedding paths
+    backend, prefix = open_location(aws_path)
+    rules = {r"(?P<plate>plate_\d{8})\.parquet": f"{prof_dir}/{{plate}}.parquet"}
+    manifest = []
     for batch in batches:
-        batch_path = f"{aws_path}/{batch}/"
-        aws_output = aws("s3", "ls", batch_path)
-        plates = re.findall(r"plate_\d{8}.parquet", aws_output)
+        manifest += build_manifest(backend, f"{prefix}/{batch}/", rules)
 
-        for plate in plates:
-            aws("s3", "cp", f"{batch_path}{plate}", f"{prof_dir}/{plate}")
+    download_all(backend, manifest, f"{prof_dir}/manifest.json")
 
 
 if __name__ == "__main__":
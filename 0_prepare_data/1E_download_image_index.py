@@ -4,15 +4,13 @@ Use AWS cli to download files that give map plate and well IDs to image names.
 
 """  # noqa: CPY001, INP001
 
-import re
-
-from sh import aws
+from download import build_manifest, download_all, open_location
 
 
 def main() -> None:
     """Download data.
 
-    Read in index file, download data.
+    Build a manifest of the load_data files of each batch and download them.
 
     """
     aws_path = "s3://cellpainting-gallery/cpg0037-oasis/axiom/workspace/load_data_csv"
@@ -20,13 +18,13 @@ def main() -> None:
 
     index_dir = "../1_snakemake/inputs/images/load_data_csv"
 
+    backend, prefix = open_location(aws_path)
+    rules = {r"(?P<plate>plate_\d{8})/load_data\.csv": f"{index_dir}/{{plate}}.csv"}
+    manifest = []
     for batch in batches:
-        batch_path = f"{aws_path}/{batch}/"
-        aws_output = aws("s3", "ls", batch_path)
-        plates = re.findall(r"plate_\d{8}", aws_output)
+        manifest += build_manifest(backend, f"{prefix}/{batch}/", rules)
 
-        for plate in plates:
-            aws("s3", "cp", f"{batch_path}{plate}/load_data.csv", f"{index_dir}/{plate}.csv")
+    download_all(backend, manifest, f"{index_dir}/manifest.json")
 
 
 if __name__ == "__main__":
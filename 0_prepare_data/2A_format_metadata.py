@@ -1,9 +1,15 @@
+import argparse
+import json
+import logging
 import os
+import re
+from pathlib import Path
 
-import numpy as np
 import polars as pl
 from tqdm import tqdm
 
+logger = logging.getLogger(__name__)
+
 meta_keep = [
     "well_id",
     "source",
@@ -28,6 +34,9 @@ meta_keep = [
     "OASIS_ID",
 ]
 
+# Plates imaged with a different microscope
+excluded_plates = ["plate_41002698", "plate_41002695", "plate_41002696"]
+
 
 def process_meta(input_meta_path: str, meta_nms: list) -> pl.DataFrame:
     """Process metadata.
@@ -49,62 +58,128 @@ def process_meta(input_meta_path: str, meta_nms: list) -> pl.DataFrame:
     return meta
 
 
-def main() -> None:
-    """Format metadata.
+def format_meta(meta: pl.DataFrame) -> pl.DataFrame:
+    """Rename metadata columns.
 
-    Merge metadata from each plate into one file.
+    Add the perturbation label and zero-pad well names, e.g. A1 -> A01.
 
     """
-    # Process metadata
-    meta_nms = [f"Metadata_{i}" for i in meta_keep]
-    meta_path = "../1_snakemake/inputs/metadata/biochem"
-    cc_path = "../1_snakemake/inputs/metadata/cc.parquet"
-    meta = []
-
-    plates = os.listdir(meta_path)
-    for plate in tqdm(plates):
-        plate_path = f"{meta_path}/{plate}"
-        meta.append(process_meta(plate_path, meta_nms))
-
-    meta = pl.concat(meta, how="vertical_relaxed")
-    meta = meta.rename({
+    well = pl.col("Metadata_Well")
+    return meta.rename({
         "Metadata_plate": "Metadata_Plate",
         "Metadata_well": "Metadata_Well",
         "Metadata_compound_name": "Metadata_Compound",
         "Metadata_compound_concentration_um": "Metadata_Concentration",
     }).with_columns(
         pl.concat_str(["Metadata_Compound", "Metadata_Concentration"], separator="_").alias("Metadata_Perturbation"),
-        pl.col("Metadata_Well")
-        .map_elements(lambda well: well if len(well) == 3 else f"{well[0]}0{well[1]}", return_dtype=pl.Utf8)
+        pl.when(well.str.len_chars() == 3)
+        .then(well)
+        .otherwise(pl.concat_str([well.str.slice(0, 1), pl.lit("0"), well.str.slice(1, 1)]))
         .alias("Metadata_Well"),
     )
 
-    compounds = meta.select("Metadata_Compound").to_series().unique().to_list()
-    compounds = [i for i in compounds if i != "DMSO"]
-    meta_log10 = meta.filter(pl.col("Metadata_Compound") == "DMSO").with_columns(
-        pl.lit(0).cast(pl.Float64).alias("Metadata_Log10Conc"),
+
+def add_log10_conc(meta: pl.DataFrame) -> pl.DataFrame:
+    """Add shifted log10 concentrations.
+
+    Each compound is shifted by |log10(lowest concentration / 3)| in a single
+    window expression over compounds. DMSO is set to 0.
+
+    """
+    conc = pl.col("Metadata_Concentration")
+    shift_val = (conc.min().over("Metadata_Compound") / 3).log10().abs()
+    return meta.with_columns(
+        pl.when(pl.col("Metadata_Compound") == "DMSO")
+        .then(pl.lit(0, dtype=pl.Float64))
+        .otherwise(conc.log10() + shift_val)
+        .alias("Metadata_Log10Conc"),
     )
 
-    for compound in compounds:
-        temp = meta.filter(pl.col("Metadata_Compound") == compound)
-        concs = temp.select(pl.col("Metadata_Concentration")).to_series().sort().unique().to_list()
-        shift_val = np.abs(np.log10(concs[0] / 3))
 
-        temp = temp.with_columns(
-            (pl.col("Metadata_Concentration").log10() + shift_val).alias("Metadata_Log10Conc"),
-        )
+def read_plate_batches(manifest_path: str) -> pl.DataFrame:
+    """Get the batch of every plate from the metadata download manifest.
+
+    Keys look like .../metadata/<batch>/<plate>/biochem.parquet.
+
+    """
+    entries = json.loads(Path(manifest_path).read_text())
+    batches = {}
+    for entry in entries:
+        match = re.search(r"([^/]+)/(plate_\d{8})/", entry["key"])
+        if match:
+            batches[match.group(2)] = match.group(1)
+    return pl.DataFrame({"Metadata_Plate": list(batches), "Metadata_Batch": list(batches.values())})
+
+
+def read_plates(plate_paths: list[str], meta_nms: list) -> pl.DataFrame:
+    """Read and format the biochem metadata of a list of plates."""
+    meta = [process_meta(plate_path, meta_nms) for plate_path in tqdm(plate_paths)]
+    return format_meta(pl.concat(meta, how="vertical_relaxed"))
 
-        meta_log10 = pl.concat([meta_log10, temp], how="vertical")
+
+def main() -> None:
+    """Format metadata.
+
+    Merge metadata from each plate into one file. With --incremental only
+    plates that are not in the cached plate metadata yet are read.
+
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--incremental", action="store_true", help="only read new biochem plates")
+    parser.add_argument(
+        "--manifest",
+        default="../1_snakemake/inputs/metadata/manifest.json",
+        help="download manifest written by 1A_download_metadata.py, gives the batch of every plate",
+    )
+    args = parser.parse_args()
+
+    # The batch partitions the raw profile datasets, so the manifest is required
+    manifest_path = args.manifest
+    if not Path(manifest_path).exists():
+        msg = f"{manifest_path} not found, run 1A_download_metadata.py first or pass --manifest"
+        raise FileNotFoundError(msg)
+
+    # Process metadata
+    meta_nms = [f"Metadata_{i}" for i in meta_keep]
+    meta_path = "../1_snakemake/inputs/metadata/biochem"
+    cc_path = "../1_snakemake/inputs/metadata/cc.parquet"
+    base_path = "../1_snakemake/inputs/metadata/metadata_plates.parquet"
+    output_path = "../1_snakemake/inputs/metadata/metadata.parquet"
+
+    plates = sorted(i for i in os.listdir(meta_path) if i.endswith(".parquet"))
+    meta = None
+    if args.incremental and Path(base_path).exists():
+        meta = pl.read_parquet(base_path)
+        done = set(meta.select("Metadata_Plate").to_series().unique().to_list())
+        plates = [i for i in plates if re.search(r"plate_\d{8}", i).group() not in done]
+
+        if not plates:
+            logger.info("No new plates")
+            return
+
+    new_meta = read_plates([f"{meta_path}/{plate}" for plate in plates], meta_nms)
+    if meta is not None:
+        new_meta = pl.concat([meta, new_meta.select(meta.columns)], how="vertical_relaxed")
+    meta = new_meta
+    meta.write_parquet(base_path)
+
+    # The log10 shift and cell count join are cheap, so they are always redone on all plates
+    meta_log10 = add_log10_conc(meta)
 
     cc = pl.read_parquet(cc_path)
     meta_log10 = meta_log10.join(cc, on=["Metadata_Plate", "Metadata_Well"])
 
     # Filter out plates with different microscope
-    meta_log10 = meta_log10.filter(
-        ~pl.col("Metadata_Plate").is_in(["plate_41002698", "plate_41002695", "plate_41002696"]),
-    )
+    meta_log10 = meta_log10.filter(~pl.col("Metadata_Plate").is_in(excluded_plates))
+
+    # Add the batch, used to partition the raw profile datasets
+    meta_log10 = meta_log10.join(read_plate_batches(manifest_path), on="Metadata_Plate", how="left")
+    missing = meta_log10.filter(pl.col("Metadata_Batch").is_null()).get_column("Metadata_Plate").unique().to_list()
+    if missing:
+        msg = f"Plates missing from {manifest_path}: {', '.join(sorted(missing))}"
+        raise ValueError(msg)
 
-    meta_log10.write_parquet("../1_snakemake/inputs/metadata/metadata.parquet")
+    meta_log10.write_parquet(output_path)
 
 
 if __name__ == "__main__":
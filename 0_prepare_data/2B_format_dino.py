@@ -1,15 +1,41 @@
-import os
+import argparse
 
+import numpy as np
 import polars as pl
-from tqdm import tqdm
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from ingest import PARTITION_COLS, ingest_plates, list_plates
+
+
+def channel_matrix(column: pa.ChunkedArray, width: int) -> np.ndarray:
+    """Reshape a list-typed embedding column into a (n_sites, width) array.
+
+    The flattened child values of the list column already hold the embeddings
+    row after row, so they are reshaped in place instead of being converted
+    to Python lists.
+
+    """
+    column = column.combine_chunks()
+    lengths = pc.list_value_length(column).to_numpy(zero_copy_only=False)
+    if not np.all(lengths == width):
+        msg = f"Expected embeddings of length {width}, found lengths {np.unique(lengths).tolist()}"
+        raise ValueError(msg)
+
+    values = column.flatten().to_numpy(zero_copy_only=False)
+    return values.reshape(len(column), width)
 
 
 def process_dino_plate(input_profile_path: str) -> pl.DataFrame:
     """Reformat Dino features.
 
+    Read the six list-typed channel columns with Arrow and write them side by
+    side into one contiguous float32 matrix.
+
     Returns
     -------
-        pl.DataFrame: A single DataFrame with all the rows from the input DataFrames concatenated vertically.
+        pl.DataFrame: One row per site with the well id and 6 x 768 features.
 
     """
     channels = [
@@ -28,61 +54,65 @@ def process_dino_plate(input_profile_path: str) -> pl.DataFrame:
         "Mito",
         "Brightfield",
     ]
+    n_feats = 768
     feat_names = []
     for nm in channel_nms:
-        feat_names += [f"{nm}_{i:03}" for i in range(1, 769)]
-    all_cols = ["Metadata_well_id", *feat_names]
+        feat_names += [f"{nm}_{i:03}" for i in range(1, n_feats + 1)]
 
     # Process embeddings
-    dat = pl.read_parquet(input_profile_path)
-    data = []
-    for i in range(dat.shape[0]):
-        features = []
-        for channel in channels:
-            features += dat.select(channel)[i].item().to_list()
-        data.append(features)
-
-    data = pl.DataFrame(data)
-    data = data.transpose()
-    data.columns = feat_names
-
-    data = data.with_columns(
-        (pl.Series(name="Metadata_well_id", values=dat.select("well_id").to_series())),
+    dat = pq.read_table(input_profile_path, columns=["well_id", *channels])
+    data = np.empty((dat.num_rows, len(channels) * n_feats), dtype=np.float32)
+    for i, channel in enumerate(channels):
+        data[:, i * n_feats : (i + 1) * n_feats] = channel_matrix(dat.column(channel), n_feats)
+
+    data = pl.from_numpy(data, schema=feat_names, orient="row")
+    return data.select(
+        pl.from_arrow(dat.column("well_id")).alias("Metadata_well_id"),
+        pl.all(),
     )
-    return data.select(all_cols)
 
 
-def main() -> None:
-    """Format Dino embeddings.
+def format_plate(plate_path: str, meta: pl.DataFrame) -> pl.DataFrame:
+    """Format one plate of Dino embeddings.
 
-    Merge Dino embeddings from each plate into one file and add metadata.
+    Add metadata and compute the median feature value per well.
 
     """
-    input_profile_path = "../1_snakemake/inputs/profiles/dino/plates"
-    meta_path = "../1_snakemake/inputs/metadata/metadata.parquet"
-    output_profile_path = "../1_snakemake/inputs/profiles/dino/raw.parquet"
-
-    meta = pl.read_parquet(meta_path)
+    data = process_dino_plate(plate_path).join(meta, on="Metadata_well_id")
 
-    profiles = []
-    plates = os.listdir(input_profile_path)
-    for plate in tqdm(plates):
-        prof_path = f"{input_profile_path}/{plate}"
-        profiles.append(process_dino_plate(prof_path))
-
-    data = pl.concat(profiles, how="vertical")
-    data = data.join(meta, on="Metadata_well_id")
-
-    # Compute median feature value per well
     meta_cols = [i for i in data.columns if "Metadata_" in i]
     feat_cols = [i for i in data.columns if "Metadata_" not in i]
 
-    data = data.group_by(["Metadata_Plate", "Metadata_Well"]).agg([
+    return data.group_by(["Metadata_Plate", "Metadata_Well"]).agg([
         pl.first(meta_cols).exclude(["Metadata_well_id", "Metadata_Plate", "Metadata_Well"]),
         pl.median(feat_cols),
     ])
 
-    data.write_parquet(output_profile_path)
+
+def main() -> None:
+    """Format Dino embeddings.
+
+    Merge Dino embeddings from each plate into one file and add metadata.
+
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--partitioned", action="store_true", help="write a dataset partitioned by batch and plate")
+    args = parser.parse_args()
+
+    input_profile_path = "../1_snakemake/inputs/profiles/dino/plates"
+    meta_path = "../1_snakemake/inputs/metadata/metadata.parquet"
+    output_profile_path = "../1_snakemake/inputs/profiles/dino/raw.parquet"
+    n_workers = 8
+
+    plates = list_plates(input_profile_path)
+    ingest_plates(
+        plates,
+        format_plate,
+        meta_path,
+        output_profile_path,
+        n_workers=n_workers,
+        partition_cols=PARTITION_COLS if args.partitioned else None,
+    )
 
 
 if __name__ == "__main__":
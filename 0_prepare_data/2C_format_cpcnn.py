@@ -1,7 +1,30 @@
-import os
+import argparse
 
 import polars as pl
-from tqdm import tqdm
+
+from ingest import PARTITION_COLS, ingest_plates, list_plates
+
+
+def format_plate(plate_path: str, meta: pl.DataFrame) -> pl.DataFrame:
+    """Format one plate of CPCNN embeddings.
+
+    Compute the median feature value per well and add metadata.
+
+    """
+    dat = pl.scan_parquet(plate_path)
+
+    meta_cols = [i for i in dat.columns if "Metadata_" in i]
+    feat_cols = [i for i in dat.columns if "Metadata_" not in i]
+
+    dat = (
+        dat.group_by(["Metadata_Plate", "Metadata_Well"])
+        .agg([
+            pl.first(meta_cols).exclude(["Metadata_Plate", "Metadata_Well"]),
+            pl.median(feat_cols),
+        ])
+        .collect()
+    )
+    return dat.join(meta, on=["Metadata_Plate", "Metadata_Well"])
 
 
 def main() -> None:
@@ -10,34 +33,24 @@ def main() -> None:
     Merge CPCNN embeddings from each plate into one file and add metadata.
 
     """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--partitioned", action="store_true", help="write a dataset partitioned by batch and plate")
+    args = parser.parse_args()
+
     input_profile_path = "../1_snakemake/inputs/profiles/cpcnn/plates"
     meta_path = "../1_snakemake/inputs/metadata/metadata.parquet"
     output_profile_path = "../1_snakemake/inputs/profiles/cpcnn/raw.parquet"
-
-    meta = pl.read_parquet(meta_path)
-
-    profiles = []
-    plates = os.listdir(input_profile_path)
-    for plate in tqdm(plates):
-        prof_path = f"{input_profile_path}/{plate}"
-        dat = pl.scan_parquet(prof_path)
-
-        meta_cols = [i for i in dat.columns if "Metadata_" in i]
-        feat_cols = [i for i in dat.columns if "Metadata_" not in i]
-
-        dat = (
-            dat.group_by(["Metadata_Plate", "Metadata_Well"])
-            .agg([
-                pl.first(meta_cols).exclude(["Metadata_Plate", "Metadata_Well"]),
-                pl.median(feat_cols),
-            ])
-            .collect()
-        )
-        profiles.append(dat)
-
-    data = pl.concat(profiles, how="vertical")
-    data = data.join(meta, on=["Metadata_Plate", "Metadata_Well"])
-    data.write_parquet(output_profile_path)
+    n_workers = 8
+
+    plates = list_plates(input_profile_path)
+    ingest_plates(
+        plates,
+        format_plate,
+        meta_path,
+        output_profile_path,
+        n_workers=n_workers,
+        partition_cols=PARTITION_COLS if args.partitioned else None,
+    )
 
 
 if __name__ == "__main__":
@@ -1,41 +1,136 @@
-import os
+import argparse
+import json
+from functools import partial
+from pathlib import Path
 
 import polars as pl
-from tqdm import tqdm
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from ingest import PARTITION_COLS, ingest_plates, list_plates
+
+ARROW_TYPES = {
+    "float32": pa.float32(),
+    "float64": pa.float64(),
+    "int64": pa.int64(),
+    "bool": pa.bool_(),
+    "category": pa.dictionary(pa.int32(), pa.string()),
+}
+
+
+def infer_schema(plate_path: str) -> dict[str, str]:
+    """Infer the column types of the CellProfiler profiles.
+
+    Features are downcast to float32 and string metadata is stored as
+    categoricals, other metadata keeps its inferred type.
+
+    Returns
+    -------
+        dict: Column name to one of the keys of ARROW_TYPES.
+
+    """
+    # Types are inferred from the first 16 MB of the plate
+    reader = pacsv.open_csv(plate_path, read_options=pacsv.ReadOptions(block_size=16 << 20))
+    schema = {}
+    for field in reader.schema:
+        if "Metadata" not in field.name:
+            schema[field.name] = "float32"
+        elif pa.types.is_boolean(field.type):
+            schema[field.name] = "bool"
+        elif pa.types.is_integer(field.type):
+            schema[field.name] = "int64"
+        elif pa.types.is_floating(field.type):
+            schema[field.name] = "float64"
+        else:
+            schema[field.name] = "category"
+    return schema
+
+
+def load_schema(plate_path: str, schema_path: str) -> dict[str, str]:
+    """Load the cached schema, inferring and saving it on the first run."""
+    if Path(schema_path).exists():
+        return json.loads(Path(schema_path).read_text())
+
+    schema = infer_schema(plate_path)
+    Path(schema_path).write_text(json.dumps(schema, indent=1))
+    return schema
+
+
+def convert_plate(plate_path: str, parquet_path: str, schema: dict[str, str]) -> None:
+    """Convert one gzipped plate csv to typed parquet.
+
+    The csv is streamed block by block, so only one block is held in memory.
+    Plates that were already converted are skipped.
+
+    """
+    if Path(parquet_path).exists():
+        return
+
+    column_types = {col: ARROW_TYPES[dtype] for col, dtype in schema.items()}
+    reader = pacsv.open_csv(
+        plate_path,
+        convert_options=pacsv.ConvertOptions(
+            column_types=column_types,
+            include_columns=list(column_types),
+            include_missing_columns=True,
+        ),
+    )
+
+    tmp_path = f"{parquet_path}.tmp"
+    with pq.ParquetWriter(tmp_path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+    Path(tmp_path).replace(parquet_path)
+
+
+def format_plate(plate_path: str, meta: pl.DataFrame, schema: dict[str, str], parquet_dir: str) -> pl.DataFrame:
+    """Format one plate of CellProfiler profiles.
+
+    Convert the plate to parquet if needed and add metadata.
+
+    """
+    parquet_path = f"{parquet_dir}/{Path(plate_path).name.split('.')[0]}.parquet"
+    convert_plate(plate_path, parquet_path, schema)
+
+    profile = pl.scan_parquet(parquet_path).with_columns(
+        pl.col(["Metadata_Plate", "Metadata_Well"]).cast(pl.Utf8),
+    )
+    return meta.lazy().join(profile, on=["Metadata_Plate", "Metadata_Well"]).collect()
 
 
 def main() -> None:
     """Format CellProfiler profiles.
 
-    Merge profiles from each plate into one file and add metadata.
+    Convert each plate to parquet once, then merge profiles from each plate
+    into one file and add metadata.
 
     """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--partitioned", action="store_true", help="write a dataset partitioned by batch and plate")
+    args = parser.parse_args()
+
     input_profile_path = "../1_snakemake/inputs/profiles/cellprofiler/plates"
+    parquet_path = "../1_snakemake/inputs/profiles/cellprofiler/parquet"
+    schema_path = "../1_snakemake/inputs/profiles/cellprofiler/schema.json"
     meta_path = "../1_snakemake/inputs/metadata/metadata.parquet"
     output_profile_path = "../1_snakemake/inputs/profiles/cellprofiler/raw.parquet"
+    n_workers = 4
 
-    meta = pl.read_parquet(meta_path)
-
-    profiles = []
-    plates = os.listdir(input_profile_path)
-    plates = [i for i in plates if "plate_" in i]
+    plates = list_plates(input_profile_path, extension=".csv.gz")
+    Path(parquet_path).mkdir(exist_ok=True)
 
     # Get column schema
-    schema = pl.read_csv(f"{input_profile_path}/{plates[0]}", infer_schema_length=10000)
-    meta_cols = [col for col in schema.columns if "Metadata" in col]
-    schema = schema.with_columns([pl.col(col).cast(pl.Float64) for col in schema.columns if col not in meta_cols])
-    schema = schema.schema
-
-    # Read in data for each plate
-    for plate in tqdm(plates):
-        prof_path = f"{input_profile_path}/{plate}"
-        profile = pl.read_csv(prof_path, schema=schema)
-        profiles.append(profile)
-
-    # Concat together
-    data = pl.concat(profiles, how="vertical_relaxed")
-    data = meta.join(data, on=["Metadata_Plate", "Metadata_Well"])
-    data.write_parquet(output_profile_path)
+    schema = load_schema(plates[0], schema_path)
+
+    ingest_plates(
+        plates,
+        partial(format_plate, schema=schema, parquet_dir=parquet_path),
+        meta_path,
+        output_profile_path,
+        n_workers=n_workers,
+        partition_cols=PARTITION_COLS if args.partitioned else None,
+    )
 
 
 if __name__ == "__main__":
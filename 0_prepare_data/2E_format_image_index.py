@@ -4,9 +4,10 @@ import polars as pl
 
 
 def main() -> None:
-    """Format CellProfiler profiles.
+    """Format image index.
 
-    Merge profiles from each plate into one file and add metadata.
+    Merge load_data files from each plate into one index of image files,
+    sorted by plate, well and site. Look it up with visualize.image_index.
 
     """
     input_index_dir = "../1_snakemake/inputs/images/load_data_csv"
@@ -14,7 +15,7 @@ def main() -> None:
 
     plate_index = []
     plates = os.listdir(input_index_dir)
-    plates = [i for i in plates if "plate_" in i]
+    plates = [i for i in plates if "plate_" in i and i.endswith(".csv")]
 
     select_cols = [
         "Metadata_Plate",
@@ -32,25 +33,18 @@ def main() -> None:
     # Read in data for each plate
     for plate in plates:
         index_path = f"{input_index_dir}/{plate}"
-        plate_temp = pl.read_csv(index_path, infer_schema_length=10000).select(select_cols)
+        plate_temp = pl.read_csv(index_path, columns=select_cols, infer_schema_length=10000)
         plate_index.append(plate_temp)
 
     # Concat together
     index = pl.concat(plate_index, how="vertical_relaxed")
 
     index = index.with_columns(
-        pl.when(pl.col("PathName_OrigBrightfield").str.contains("prod_25"))
-        .then(pl.lit("prod_25"))
-        .when(pl.col("PathName_OrigBrightfield").str.contains("prod_26"))
-        .then(pl.lit("prod_26"))
-        .when(pl.col("PathName_OrigBrightfield").str.contains("prod_27"))
-        .then(pl.lit("prod_27"))
-        .when(pl.col("PathName_OrigBrightfield").str.contains("prod_30"))
-        .then(pl.lit("prod_30"))
-        .alias("Metadata_Batch"),
+        pl.col("PathName_OrigBrightfield").str.extract(r"(prod_\d+)").alias("Metadata_Batch"),
     )
 
     index = index.rename({
+        "PathName_OrigBrightfield": "PathName",
         "FileName_OrigBrightfield": "Brightfield",
         "FileName_OrigRNA": "RNA",
         "FileName_OrigDNA": "DNA",
@@ -60,12 +54,17 @@ def main() -> None:
     })
 
     index = index.melt(
-        id_vars=["Metadata_Batch", "Metadata_Plate", "Metadata_Well", "Metadata_Site"],
+        id_vars=["Metadata_Batch", "Metadata_Plate", "Metadata_Well", "Metadata_Site", "PathName"],
         value_vars=["Brightfield", "RNA", "DNA", "Mito", "ER", "AGP"],
         variable_name="Channel",
         value_name="Filename",
     )
 
+    # Sort by lookup key and dictionary-encode the repeated columns
+    index = index.sort(["Metadata_Plate", "Metadata_Well", "Metadata_Site", "Channel"]).with_columns(
+        pl.col(["Metadata_Batch", "Metadata_Plate", "Metadata_Well", "PathName", "Channel"]).cast(pl.Categorical),
+    )
+
     index.write_parquet(output_index_path)
 
 
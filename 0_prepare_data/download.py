@@ -0,0 +1,282 @@
+"""Concurrent, resumable bulk downloads.
+
+Build a manifest of the objects expected under a bucket prefix, download
+them with a pool of workers and verify every file against the size and
+ETag reported by the storage backend. The manifest is saved next to the
+downloads and records which files are verified, so an interrupted run
+resumes where it stopped.
+
+"""  # noqa: CPY001, INP001
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+
+from sh import ErrorReturnCode, aws
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+MIB = 1024 * 1024
+# Default multipart chunk size of the AWS CLI
+AWS_CHUNK_SIZE = 8 * MIB
+
+
+@dataclass(frozen=True)
+class RemoteObject:
+    """An object listed by a storage backend."""
+
+    key: str
+    size: int
+    etag: str
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    """An expected object and where to store it."""
+
+    key: str
+    size: int
+    etag: str
+    dest: str
+    verified: bool = False
+
+
+class S3Backend:
+    """List and fetch objects from an S3 bucket with the AWS CLI."""
+
+    def __init__(self, bucket: str) -> None:
+        """Use the given bucket."""
+        self.bucket = bucket
+        self._aws = aws
+
+    def list_objects(self, prefix: str) -> list[RemoteObject]:
+        """List all objects under a prefix."""
+        output = self._aws(
+            "s3api", "list-objects-v2", "--bucket", self.bucket, "--prefix", prefix, "--output", "json",
+        )
+        contents = json.loads(output or "{}").get("Contents", [])
+        return [RemoteObject(obj["Key"], int(obj["Size"]), obj["ETag"].strip('"')) for obj in contents]
+
+    def fetch(self, key: str, dest: str) -> None:
+        """Download one object."""
+        self._aws("s3", "cp", f"s3://{self.bucket}/{key}", dest, "--only-show-errors")
+
+
+class LocalBackend:
+    """Serve objects from a local directory that stands in for a bucket."""
+
+    def __init__(self, root: str) -> None:
+        """Use the given directory as the bucket root."""
+        self.root = Path(root)
+
+    def list_objects(self, prefix: str) -> list[RemoteObject]:
+        """List all files under a prefix, which names a directory."""
+        objects = []
+        for path in sorted((self.root / prefix).rglob("*")):
+            if path.is_file():
+                key = path.relative_to(self.root).as_posix()
+                objects.append(RemoteObject(key, path.stat().st_size, file_md5(path)))
+        return objects
+
+    def fetch(self, key: str, dest: str) -> None:
+        """Copy one file."""
+        shutil.copyfile(self.root / key, dest)
+
+
+def open_location(url: str) -> tuple[S3Backend | LocalBackend, str]:
+    """Get the backend and key prefix for an s3:// URL or a local directory."""
+    if url.startswith("s3://"):
+        bucket, _, prefix = url.removeprefix("s3://").partition("/")
+        return S3Backend(bucket), prefix
+    return LocalBackend(url), ""
+
+
+def file_md5(path: str | Path, start: int = 0, length: int | None = None) -> str:
+    """Get the md5 hex digest of a file or of a byte range of it."""
+    md5 = hashlib.md5()  # noqa: S324
+    with Path(path).open("rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(MIB if remaining is None else min(MIB, remaining))
+            if not chunk:
+                break
+            md5.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return md5.hexdigest()
+
+
+def etag_matches(path: str | Path, etag: str) -> bool:
+    """Check a local file against an S3 ETag.
+
+    Single-part ETags are the md5 of the file. Multipart ETags are the md5 of
+    the concatenated part digests followed by the number of parts, so the
+    part size is not known. The AWS CLI default and the smallest whole-MiB
+    size that gives that number of parts are tried. A file whose digest
+    differs for a part size giving that number of parts is corrupt. If no
+    candidate gives that number of parts, the upload used another part size
+    and only the file size, checked by the caller, is verified.
+
+    """
+    if "-" not in etag:
+        return file_md5(path) == etag
+
+    digest, n_parts = etag.split("-")
+    n_parts = int(n_parts)
+    size = Path(path).stat().st_size
+    candidates = {AWS_CHUNK_SIZE, -(-size // n_parts // MIB) * MIB}
+    tried = False
+    for part_size in candidates:
+        if -(-size // part_size) != n_parts:
+            continue
+        tried = True
+        md5 = hashlib.md5()  # noqa: S324
+        for i in range(n_parts):
+            md5.update(bytes.fromhex(file_md5(path, i * part_size, part_size)))
+        if md5.hexdigest() == digest:
+            return True
+    if tried:
+        return False
+    logger.warning(f"Unknown part size for multipart ETag {etag} of {path}, only its size is verified")  # noqa: G004
+    return True
+
+
+def build_manifest(
+    backend: S3Backend | LocalBackend,
+    prefix: str,
+    rules: dict[str, str],
+) -> list[ManifestEntry]:
+    """List a prefix and select the objects to download.
+
+    Parameters
+    ----------
+    backend : S3Backend or LocalBackend
+        Storage to list.
+    prefix : str
+        Key prefix to list, e.g. a batch folder.
+    rules : dict
+        Maps regular expressions, matched against the whole key relative to
+        prefix, to destination path templates filled with the named groups.
+
+    Returns
+    -------
+        list: One entry per selected object.
+
+    """
+    prefix = prefix.lstrip("/")
+    entries = []
+    for obj in backend.list_objects(prefix):
+        rel_key = obj.key.removeprefix(prefix).lstrip("/")
+        for pattern, dest in rules.items():
+            match = re.fullmatch(pattern, rel_key)
+            if match:
+                entries.append(ManifestEntry(obj.key, obj.size, obj.etag, dest.format(**match.groupdict())))
+                break
+    return entries
+
+
+def _load_verified(manifest_path: Path) -> set[tuple[str, int, str, str]]:
+    if not manifest_path.exists():
+        return set()
+    entries = json.loads(manifest_path.read_text())
+    return {(e["key"], e["size"], e["etag"], e["dest"]) for e in entries if e["verified"]}
+
+
+def _save_manifest(entries: dict[str, ManifestEntry], manifest_path: Path) -> None:
+    tmp_path = manifest_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps([asdict(e) for e in entries.values()], indent=1))
+    tmp_path.replace(manifest_path)
+
+
+def _download(backend: S3Backend | LocalBackend, entry: ManifestEntry, retries: int) -> ManifestEntry:
+    dest = Path(entry.dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+
+    # Files from earlier runs only need to be verified
+    if dest.exists() and dest.stat().st_size == entry.size and etag_matches(dest, entry.etag):
+        return replace(entry, verified=True)
+
+    part = dest.with_name(f"{dest.name}.part")
+    for attempt in range(1, retries + 1):
+        try:
+            backend.fetch(entry.key, str(part))
+            if part.stat().st_size != entry.size:
+                msg = f"size {part.stat().st_size} != {entry.size}"
+                raise ValueError(msg)  # noqa: TRY301
+            if not etag_matches(part, entry.etag):
+                msg = f"ETag mismatch for {entry.etag}"
+                raise ValueError(msg)  # noqa: TRY301
+        except (ErrorReturnCode, OSError, ValueError) as e:
+            logger.warning(f"Attempt {attempt} failed for {entry.key}: {e}")  # noqa: G004
+            part.unlink(missing_ok=True)
+        else:
+            part.replace(dest)
+            return replace(entry, verified=True)
+    return entry
+
+
+def download_all(
+    backend: S3Backend | LocalBackend,
+    entries: list[ManifestEntry],
+    manifest_path: str,
+    *,
+    n_workers: int = 16,
+    retries: int = 3,
+) -> None:
+    """Download and verify every manifest entry.
+
+    Entries verified by an earlier run are skipped if their file is still
+    there with the expected size. The manifest is rewritten after every
+    finished file.
+
+    Parameters
+    ----------
+    backend : S3Backend or LocalBackend
+        Storage to download from.
+    entries : list of ManifestEntry
+        Objects to download, usually from build_manifest.
+    manifest_path : str
+        JSON file recording the manifest and which entries are verified.
+    n_workers : int, default 16
+        Number of concurrent downloads.
+    retries : int, default 3
+        Attempts per file before it is reported as failed.
+
+    """
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    verified = _load_verified(manifest_path)
+
+    state = {}
+    todo = []
+    for entry in entries:
+        dest = Path(entry.dest)
+        done = (entry.key, entry.size, entry.etag, entry.dest) in verified
+        if done and dest.exists() and dest.stat().st_size == entry.size:
+            state[entry.dest] = replace(entry, verified=True)
+        else:
+            state[entry.dest] = replace(entry, verified=False)
+            todo.append(state[entry.dest])
+    _save_manifest(state, manifest_path)
+    logger.info(f"{len(entries) - len(todo)} of {len(entries)} files already verified")  # noqa: G004
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(_download, backend, entry, retries) for entry in todo]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            entry = future.result()
+            state[entry.dest] = entry
+            _save_manifest(state, manifest_path)
+
+    failed = [e.key for e in state.values() if not e.verified]
+    if failed:
+        msg = f"{len(failed)} files failed to download or verify: {failed}"
+        raise RuntimeError(msg)
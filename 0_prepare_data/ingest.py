@@ -0,0 +1,212 @@
+"""Shared per-plate ingestion for the profile format scripts.
+
+Plates are formatted in a process pool and every finished plate is streamed
+into one parquet file, or into a hive-partitioned dataset, as soon as it is
+ready. Peak memory is therefore about one plate per worker instead of the
+whole batch.
+
+"""  # noqa: CPY001, INP001
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import polars as pl
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from typing import Self
+
+    import pyarrow as pa
+
+# Layout of the partitioned raw profile datasets
+PARTITION_COLS = ["Metadata_Batch", "Metadata_Plate"]
+SORT_COLS = ["Metadata_Compound", "Metadata_Concentration"]
+
+# Metadata is loaded once per worker by the pool initializer
+_meta: pl.DataFrame | None = None
+
+
+def _init_worker(meta_path: str) -> None:
+    global _meta  # noqa: PLW0603
+    _meta = pl.read_parquet(meta_path)
+
+
+def _format_plate(
+    format_plate: Callable[[str, pl.DataFrame], pl.DataFrame],
+    plate_path: str,
+) -> tuple[str, pa.Table]:
+    return Path(plate_path).name.split(".")[0], format_plate(plate_path, _meta).to_arrow()
+
+
+def list_plates(input_dir: str, extension: str = ".parquet") -> list[str]:
+    """List the per-plate files in a download directory.
+
+    Only names ending with extension are listed, so e.g. the .part files of
+    an interrupted download are skipped.
+
+    Returns
+    -------
+        list: Sorted paths of all files whose name contains "plate_".
+
+    """
+    plates = sorted(p.name for p in Path(input_dir).iterdir() if "plate_" in p.name and p.name.endswith(extension))
+    return [f"{input_dir}/{plate}" for plate in plates]
+
+
+class PlateWriter:
+    """Append formatted plates to a parquet file or a partitioned dataset.
+
+    The first plate fixes the schema of a single-file output and later plates
+    are cast to it. With partition_cols every plate is written to its own file
+    under a hive-style directory tree rooted at output_path, with rows sorted
+    by compound so that row group statistics can prune e.g. DMSO-only reads.
+    The output replaces any previous one when the writer is closed.
+
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        partition_cols: list[str] | None = None,
+        row_group_size: int = 96,
+    ) -> None:
+        """Open the writer.
+
+        Parameters
+        ----------
+        output_path : str
+            Parquet file, or dataset root when partition_cols is given.
+        partition_cols : list of str, optional
+            Columns to partition the dataset by.
+        row_group_size : int, default 96
+            Rows per row group of the partitioned dataset.
+
+        """
+        self.output_path = output_path
+        self.partition_cols = partition_cols
+        self.row_group_size = row_group_size
+        self._tmp_path = f"{output_path}.tmp"
+        self._writer = None
+        if partition_cols:
+            shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+    def write(self, name: str, table: pa.Table) -> None:
+        """Write one formatted plate."""
+        if self.partition_cols:
+            missing = [c for c in self.partition_cols if c not in table.column_names]
+            if missing:
+                msg = f"Partition columns {missing} are missing from plate {name}"
+                raise ValueError(msg)
+
+            sort_cols = [c for c in SORT_COLS if c in table.column_names]
+            pq.write_to_dataset(
+                table.sort_by([(c, "ascending") for c in sort_cols]),
+                root_path=self._tmp_path,
+                partition_cols=self.partition_cols,
+                basename_template=f"{name}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                row_group_size=self.row_group_size,
+                use_threads=False,
+            )
+            return
+
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._tmp_path, table.schema)
+        elif not table.schema.equals(self._writer.schema):
+            table = table.select(self._writer.schema.names).cast(self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        """Finish the output and move it into place."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if not Path(self._tmp_path).exists():
+            return
+
+        output_path = Path(self.output_path)
+        if output_path.is_dir():
+            shutil.rmtree(output_path)
+        elif self.partition_cols:
+            output_path.unlink(missing_ok=True)
+        Path(self._tmp_path).replace(output_path)
+
+    def __enter__(self) -> Self:  # noqa: D105
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:  # noqa: ANN001, D105
+        if exc_type is None:
+            self.close()
+            return
+
+        if self._writer is not None:
+            self._writer.close()
+        if Path(self._tmp_path).is_dir():
+            shutil.rmtree(self._tmp_path)
+        else:
+            Path(self._tmp_path).unlink(missing_ok=True)
+
+
+def ingest_plates(
+    plate_paths: list[str],
+    format_plate: Callable[[str, pl.DataFrame], pl.DataFrame],
+    meta_path: str,
+    output_path: str,
+    *,
+    n_workers: int | None = None,
+    partition_cols: list[str] | None = None,
+) -> None:
+    """Format plates in parallel and stream them into one output.
+
+    Parameters
+    ----------
+    plate_paths : list of str
+        Per-plate input files.
+    format_plate : callable
+        Module-level function taking a plate path and the metadata frame and
+        returning the formatted plate, including its metadata columns.
+    meta_path : str
+        Path to metadata.parquet, read once in every worker.
+    output_path : str
+        Output parquet file, or dataset root when partition_cols is given.
+    n_workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    partition_cols : list of str, optional
+        Write a hive-partitioned dataset split by these columns, usually
+        PARTITION_COLS, instead of a single file.
+
+    """
+    n_workers = n_workers or os.cpu_count()
+
+    # polars is multithreaded, so workers are spawned rather than forked
+    with (
+        ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(meta_path,),
+        ) as pool,
+        PlateWriter(output_path, partition_cols) as writer,
+        tqdm(total=len(plate_paths)) as progress,
+    ):
+        pending = set()
+        for plate_path in plate_paths:
+            # Bound the number of finished plates waiting in memory
+            if len(pending) >= n_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    writer.write(*future.result())
+                    progress.update()
+            pending.add(pool.submit(_format_plate, format_plate, plate_path))
+
+        for future in as_completed(pending):
+            writer.write(*future.result())
+            progress.update()
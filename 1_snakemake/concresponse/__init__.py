@@ -1,2 +1,4 @@
 from . import ap as ap
+from . import cmd as cmd
 from . import compile_dist as compile_dist
+from . import gmd as gmd
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 import polars as pl
 from copairs import map
 from copairs.matching import assign_reference_index
@@ -7,18 +9,37 @@ import numpy as np
 import random
 from joblib import Parallel, delayed
 
+from .cmd import calculate_cmd
+from .gmd import calculate_gmd
+
 n_cpus = 10
 
+
+def scan_profiles(prof_path: str) -> pl.LazyFrame:
+    """Lazily scan a profile parquet file or hive-partitioned dataset."""
+    if Path(prof_path).is_dir():
+        return pl.scan_parquet(f"{prof_path}/**/*.parquet", hive_partitioning=True)
+    return pl.scan_parquet(prof_path)
+
+
 def phenotypic_consistency_dmso(cmpd: str, prof_path: str):
 
-    profiles = pl.read_parquet(prof_path)
-    feat_cols = [i for i in profiles.columns if "Metadata" not in i]
+    profiles = scan_profiles(prof_path)
     dmso_profiles = profiles.filter(pl.col("Metadata_Compound") == "DMSO")
 
-    cmpd_profs = profiles.filter(pl.col("Metadata_Compound") == cmpd)
-    cmpd_plates = cmpd_profs.select(pl.col("Metadata_Plate")).to_series().unique().to_list()
-    cmpd_dmso = dmso_profiles.filter(pl.col("Metadata_Plate").is_in(cmpd_plates)).with_row_index().with_columns(
-        pl.lit(cmpd).alias("Metadata_Compound_DMSO")
+    cmpd_plates = (
+        profiles.filter(pl.col("Metadata_Compound") == cmpd)
+        .select(pl.col("Metadata_Plate"))
+        .collect()
+        .to_series()
+        .unique()
+        .to_list()
+    )
+    cmpd_dmso = (
+        dmso_profiles.filter(pl.col("Metadata_Plate").is_in(cmpd_plates))
+        .collect()
+        .with_row_index()
+        .with_columns(pl.lit(cmpd).alias("Metadata_Compound_DMSO"))
     )
 
     # Choose 720 samples to have even multiple of 16
@@ -51,7 +72,7 @@ def phenotypic_activity_compound(cmpd: str, prof_path: str):
     """ Function to process each compound in parallel """
 
     # get data
-    profiles = pl.scan_parquet(prof_path)
+    profiles = scan_profiles(prof_path)
     feat_cols = [i for i in profiles.collect_schema().names() if "Metadata" not in i]
     dmso_profiles = profiles.filter(pl.col("Metadata_Compound") == "DMSO")
 
@@ -93,7 +114,7 @@ def phenotypic_activity_compound(cmpd: str, prof_path: str):
 
 def calculate_ap(prof_path: str):
 
-    lf = pl.scan_parquet(prof_path)
+    lf = scan_profiles(prof_path)
     compounds = lf.select("Metadata_Compound").collect().to_series().unique().to_list()
     compounds = [i for i in compounds if "DMSO" not in i]
 
@@ -121,10 +142,37 @@ def calculate_ap(prof_path: str):
     return ap
 
 
-def calculate_distances(prof_path: str, dist_path: str, method: str):
+def calculate_distances(
+    prof_path: str,
+    dist_path: str,
+    method: str,
+    cover_var: float = 0.95,
+    treatment: str = "Metadata_Perturbation",
+    *,
+    categories: list | None = None,
+    n_workers: int | None = None,
+    model_dir: str | None = None,
+    frozen: bool = False,
+) -> None:
 
     if method == "ap":
         dist = calculate_ap(prof_path)
         dist.write_parquet(dist_path)
+    elif method == "gmd":
+        model_path = None if model_dir is None else Path(model_dir) / "gmd.npz"
+        dist = calculate_gmd(scan_profiles(prof_path).collect(), cover_var, treatment, model_path, frozen=frozen)
+        dist.write_parquet(dist_path)
+    elif method == "cmd":
+        cmd_dir = None if model_dir is None else Path(model_dir) / "cmd"
+        dist = calculate_cmd(
+            scan_profiles(prof_path).collect(),
+            cover_var,
+            treatment,
+            categories,
+            n_workers=n_workers,
+            model_dir=cmd_dir,
+            frozen=frozen,
+        )
+        dist.write_parquet(dist_path)
     else:
-        print("METHOD NOT FOUND")
\ No newline at end of file
+        print("METHOD NOT FOUND")
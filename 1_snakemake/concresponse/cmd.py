@@ -0,0 +1,136 @@
+"""Category Mahalanobis distance (CMD): GMD within every feature category.
+
+Port of cmd_functions.R and the cmd part of compute_distances.R. The
+feature matrix is put once in shared memory and categories run in a
+process pool, every worker reads only the columns of its category.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+import polars as pl
+from tqdm import tqdm
+
+from .gmd import feature_columns, fit_or_load
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+
+def category_columns(feat_cols: list[str], categories: list[str]) -> dict[str, np.ndarray]:
+    """Find the column indices of every category, as compute_distances.R does.
+
+    Categories with "_", e.g. "Cells_AGP", are CellProfiler compartment and
+    channel pairs matched against the non Image features. Otherwise, e.g.
+    for DINO, a category matches every feature that contains it.
+    """
+    if "_" in categories[0]:
+        noimg = [i for i, c in enumerate(feat_cols) if "Image" not in c]
+        columns = {}
+        for category in categories:
+            compartment, channel = category.split("_")[:2]
+            columns[category] = np.array(
+                [i for i in noimg if re.search(compartment, feat_cols[i]) and re.search(channel, feat_cols[i])],
+                dtype=np.int64,
+            )
+        return columns
+    return {
+        category: np.array([i for i, c in enumerate(feat_cols) if re.search(category, c)], dtype=np.int64)
+        for category in categories
+    }
+
+
+def _cmd_category(
+    shm_name: str,
+    shape: tuple[int, int],
+    cols: np.ndarray,
+    features: Sequence[str],
+    cover_var: float,
+    treatment_labels: np.ndarray,
+    plates: np.ndarray,
+    labels: np.ndarray,
+    model_path: Path | None,
+    *,
+    frozen: bool,
+) -> np.ndarray:
+    """Compute the CMD of one category from the shared feature matrix."""
+    shm = SharedMemory(name=shm_name)
+    try:
+        # Column-major, so the category columns are contiguous copies
+        vals = np.ndarray(shape, dtype=np.float64, buffer=shm.buf, order="F")[:, cols]
+    finally:
+        shm.close()
+    model = fit_or_load(vals, features, cover_var, treatment_labels, model_path, frozen=frozen)
+    return model.score(vals, plates, labels)
+
+
+def calculate_cmd(
+    profiles: pl.DataFrame,
+    cover_var: float,
+    treatment: str,
+    categories: list[str],
+    *,
+    n_workers: int | None = None,
+    model_dir: str | Path | None = None,
+    frozen: bool = False,
+) -> pl.DataFrame:
+    """CMD of every well and category, with its metadata.
+
+    Rows are grouped by category in the given order, then by plate in order
+    of appearance, as in R. The model of every category is saved in
+    model_dir as {category}.npz, with frozen the saved ones are used.
+    """
+    meta = profiles.select([c for c in profiles.columns if "Metadata_" in c]).to_pandas()
+    feat_cols = feature_columns(profiles.columns)
+    columns = category_columns(feat_cols, categories)
+
+    plates = meta["Metadata_Plate"].to_numpy()
+    labels = meta["Metadata_Compound"].to_numpy()
+    treatment_labels = meta[treatment].to_numpy()
+
+    # The only full copy of the features, filled one column at a time
+    shape = (len(profiles), len(feat_cols))
+    shm = SharedMemory(create=True, size=max(8 * shape[0] * shape[1], 1))
+    try:
+        shared = np.ndarray(shape, dtype=np.float64, buffer=shm.buf, order="F")
+        for i, c in enumerate(feat_cols):
+            shared[:, i] = profiles.get_column(c).to_numpy()
+        del shared
+
+        # arrow is multithreaded, so workers are spawned rather than forked
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(
+                    _cmd_category,
+                    shm.name,
+                    shape,
+                    columns[c],
+                    [feat_cols[i] for i in columns[c]],
+                    cover_var,
+                    treatment_labels,
+                    plates,
+                    labels,
+                    None if model_dir is None else Path(model_dir) / f"{c}.npz",
+                    frozen=frozen,
+                )
+                for c in categories
+            ]
+            distances = [f.result() for f in tqdm(futures, leave=False)]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    order = np.argsort(pd.factorize(plates)[0], kind="stable")
+    plate_meta = meta.iloc[order].reset_index(drop=True)
+    cmd_df = pd.concat(
+        [plate_meta.assign(Metadata_Distance=c, Distance=d[order]) for c, d in zip(categories, distances, strict=True)],
+        ignore_index=True,
+    )
+    return pl.from_pandas(cmd_df)
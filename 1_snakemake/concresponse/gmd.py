@@ -0,0 +1,242 @@
+"""Grit-like Mahalanobis distance (GMD) of every well to the DMSO wells of its plate.
+
+Port of gmd_functions.R and the gmd part of compute_distances.R. Distances
+of all wells are computed at once instead of one row at a time.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+import polars as pl
+from scipy.linalg import cholesky, solve_triangular
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+
+    from numpy.typing import ArrayLike
+
+
+def feature_columns(columns: Iterable[str]) -> list[str]:
+    """Find the features used by the distances.
+
+    Like compute_distances.R, ObjectSkeleton features are left out, they
+    cause major problems.
+    """
+    return [c for c in columns if "Metadata_" not in c and "ObjectSkeleton" not in c]
+
+
+def split_profiles(profiles: pl.DataFrame) -> tuple[pd.DataFrame, np.ndarray, list[str]]:
+    """Split profiles into metadata and the float64 feature matrix used by the distances."""
+    meta = profiles.select([c for c in profiles.columns if "Metadata_" in c]).to_pandas()
+    feat_cols = feature_columns(profiles.columns)
+    vals = profiles.select(feat_cols).to_numpy().astype(np.float64)
+    return meta, vals, feat_cols
+
+
+def prep_gmd(
+    vals: np.ndarray, cover_var: float, treatment_labels: ArrayLike,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Fit the scaling, PCA rotation and Cholesky factor of the within-treatment covariance.
+
+    Same as prep_gmd in R: prcomp with centering and scaling, keep the PCs
+    needed to cover cover_var of the variance plus one, and estimate the
+    residual covariance of the PC scores after fitting one mean per
+    treatment, with n - n_treatments degrees of freedom.
+    """
+    n = len(vals)
+    mean, scale = vals.mean(axis=0), vals.std(axis=0, ddof=1)
+    scaled = (vals - mean) / scale
+    u, s, vt = np.linalg.svd(scaled, full_matrices=False)
+    cumul_proportion = np.cumsum(s**2) / np.sum(s**2)
+
+    pc = min(np.count_nonzero(cumul_proportion < cover_var) + 1, n)
+    rotation = vt[:pc].T
+    scores = u[:, :pc] * s[:pc]
+
+    # Residuals of lm(scores ~ 0 + treatment_labels) are deviations from the treatment means
+    codes, uniques = pd.factorize(np.asarray(treatment_labels))
+    sums = np.zeros((len(uniques), pc))
+    np.add.at(sums, codes, scores)
+    residuals = scores - (sums / np.bincount(codes)[:, None])[codes]
+    cov = residuals.T @ residuals / (n - len(uniques))
+
+    return mean, scale, rotation, cholesky(cov, lower=True)
+
+
+def compute_gmd(
+    vals: np.ndarray,
+    rotation: np.ndarray,
+    chol: np.ndarray,
+    plates: ArrayLike,
+    labels: ArrayLike,
+    *,
+    control: str = "DMSO",
+) -> np.ndarray:
+    """Mahalanobis distance of every well to the mean control well of its plate.
+
+    Wells are projected on the PCs without centering or scaling, as in R.
+    With cov = L L^T, the squared distance of delta is |L^-1 delta|^2, so
+    all wells take one triangular solve. Distances are rounded to 3 decimals.
+    """
+    scores = vals @ rotation
+    plate_codes, plate_names = pd.factorize(np.asarray(plates))
+    control_rows = np.asarray(labels) == control
+
+    # Mean control scores of every plate, NaN without control wells
+    sums = np.zeros((len(plate_names), scores.shape[1]))
+    np.add.at(sums, plate_codes[control_rows], scores[control_rows])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ctrl_mean = sums / np.bincount(plate_codes[control_rows], minlength=len(plate_names))[:, None]
+
+    delta = scores - ctrl_mean[plate_codes]
+    z = solve_triangular(chol, delta.T, lower=True, check_finite=False)
+    return np.round(np.sqrt(np.einsum("ij,ij->j", z, z)), 3)
+
+
+class DistanceModel:
+    """Frozen GMD fit of one feature set, saved as a versioned .npz artifact.
+
+    Holds what prep_gmd fits: the prcomp centering and scaling, the rotation
+    of the PCs covering cover_var, and the within-treatment covariance as
+    its Cholesky factor, i.e. the inverse covariance used by the distances.
+    New plates can be scored against it without refitting.
+    """
+
+    version = 2
+
+    def __init__(
+        self,
+        features: Sequence[str],
+        cover_var: float,
+        mean: np.ndarray,
+        scale: np.ndarray,
+        rotation: np.ndarray,
+        chol: np.ndarray,
+    ) -> None:
+        """Hold a fit of prep_gmd on the given features."""
+        self.features = list(features)
+        self.cover_var = float(cover_var)
+        self.mean = mean
+        self.scale = scale
+        self.rotation = rotation
+        self.chol = chol
+
+    @classmethod
+    def fit(
+        cls, vals: np.ndarray, features: Sequence[str], cover_var: float, treatment_labels: ArrayLike,
+    ) -> DistanceModel:
+        """Fit the model on the feature matrix vals, with prep_gmd."""
+        return cls(features, cover_var, *prep_gmd(vals, cover_var, treatment_labels))
+
+    @property
+    def n_components(self) -> int:
+        """Number of PCs kept."""
+        return self.rotation.shape[1]
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the version, features and cover_var and of the fitted arrays.
+
+        The arrays are hashed with their dtype and shape, so a saved model
+        whose parameters were changed or truncated does not match.
+        """
+        key = json.dumps({"version": self.version, "features": self.features, "cover_var": self.cover_var})
+        digest = hashlib.sha256(key.encode())
+        for array in map(np.ascontiguousarray, (self.mean, self.scale, self.rotation, self.chol)):
+            digest.update(f"{array.dtype.str}{array.shape}".encode())
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def score(self, vals: np.ndarray, plates: ArrayLike, labels: ArrayLike, control: str = "DMSO") -> np.ndarray:
+        """GMD of every well to the control wells of its plate, see compute_gmd."""
+        return compute_gmd(vals, self.rotation, self.chol, plates, labels, control=control)
+
+    def save(self, path: str | Path) -> None:
+        """Save the model as a .npz file, creating its directory."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            path,
+            version=self.version,
+            fingerprint=self.fingerprint,
+            features=np.array(self.features),
+            cover_var=self.cover_var,
+            mean=self.mean,
+            scale=self.scale,
+            rotation=self.rotation,
+            chol=self.chol,
+        )
+
+    @classmethod
+    def load(cls, path: str | Path, features: Sequence[str] | None = None) -> DistanceModel:
+        """Load a saved model, checking its version and, if given, its features."""
+        with np.load(path) as data:
+            if int(data["version"]) != cls.version:
+                msg = f"{path} has model version {int(data['version'])}, expected {cls.version}"
+                raise ValueError(msg)
+            model = cls(
+                data["features"].tolist(),
+                data["cover_var"],
+                data["mean"],
+                data["scale"],
+                data["rotation"],
+                data["chol"],
+            )
+            if str(data["fingerprint"]) != model.fingerprint:
+                msg = f"{path} does not match its fingerprint"
+                raise ValueError(msg)
+        if features is not None and list(features) != model.features:
+            msg = f"{path} was fitted on other features, {len(model.features)} saved and {len(features)} given"
+            raise ValueError(msg)
+        return model
+
+
+def fit_or_load(
+    vals: np.ndarray,
+    features: Sequence[str],
+    cover_var: float,
+    treatment_labels: ArrayLike,
+    model_path: str | Path | None = None,
+    *,
+    frozen: bool = False,
+) -> DistanceModel:
+    """Load the model saved at model_path if frozen, else fit it and save it there."""
+    if frozen and model_path is None:
+        msg = "frozen=True requires model_path"
+        raise ValueError(msg)
+    if frozen:
+        return DistanceModel.load(model_path, features)
+    model = DistanceModel.fit(vals, features, cover_var, treatment_labels)
+    if model_path is not None:
+        model.save(model_path)
+    return model
+
+
+def calculate_gmd(
+    profiles: pl.DataFrame,
+    cover_var: float,
+    treatment: str,
+    model_path: str | Path | None = None,
+    *,
+    frozen: bool = False,
+) -> pl.DataFrame:
+    """GMD of every well, with its metadata, wells grouped by plate as in R.
+
+    The fitted model is saved at model_path. With frozen, the model saved
+    there is used instead of fitting one on these profiles.
+    """
+    meta, vals, feat_cols = split_profiles(profiles)
+    model = fit_or_load(vals, feat_cols, cover_var, meta[treatment], model_path, frozen=frozen)
+
+    gmd = model.score(vals, meta["Metadata_Plate"], meta["Metadata_Compound"])
+
+    # R binds plates in order of first appearance
+    order = np.argsort(pd.factorize(meta["Metadata_Plate"])[0], kind="stable")
+    gmd_df = meta.iloc[order].reset_index(drop=True)
+    gmd_df["Metadata_Distance"] = "gmd"
+    gmd_df["Distance"] = gmd[order]
+    return pl.from_pandas(gmd_df)
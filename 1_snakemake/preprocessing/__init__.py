@@ -1,6 +1,7 @@
 from . import io as io
 from . import normalize as normalize
 from . import outliers as outliers
+from . import pipeline as pipeline
 from . import stats as stats
 from . import transform as transform
 from .feature_selection import select_features as select_features
@@ -0,0 +1,229 @@
+"""
+Returns list of features such that no two features have a correlation greater than a
+specified threshold
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+def get_pairwise_correlation(population_df, method="pearson"):
+    """Given a population dataframe, calculate all pairwise correlations.
+
+    Parameters
+    ----------
+    population_df : pandas.core.frame.DataFrame
+        Includes metadata and observation features.
+    method : str, default "pearson"
+        Which correlation matrix to use to test cutoff.
+    Returns
+    -------
+    list of str
+        Features to exclude from the population_df.
+
+    """
+
+    # Get a symmetrical correlation matrix. Use numpy for non NaN/Inf matrices.
+    has_nan = np.any(np.isnan(population_df.values))
+    has_inf = np.any(np.isinf(population_df.values))
+    if method == "pearson" and not (has_nan or has_inf):
+        pop_names = population_df.columns
+        data_cor_df = np.corrcoef(population_df.transpose())
+        data_cor_df = pd.DataFrame(data_cor_df, index=pop_names, columns=pop_names)
+    else:
+        data_cor_df = population_df.corr(method=method)
+
+    # Create a copy of the dataframe to generate upper triangle of zeros
+    data_cor_natri_df = data_cor_df.copy()
+
+    # Replace upper triangle in correlation matrix with NaN
+    data_cor_natri_df = data_cor_natri_df.where(
+        np.tril(np.ones(data_cor_natri_df.shape), k=-1).astype(bool)
+    )
+
+    # Acquire pairwise correlations in a long format
+    # Note that we are using the NaN upper triangle DataFrame
+    pairwise_df = data_cor_natri_df.stack().reset_index()
+    pairwise_df.columns = ["pair_a", "pair_b", "correlation"]
+
+    return data_cor_df, pairwise_df
+
+def _correlation64(
+    centered: Callable[[np.ndarray | slice], np.ndarray], norms: np.ndarray, a: np.ndarray, b: np.ndarray,
+) -> np.ndarray:
+    """Pearson correlation of the columns a and b, computed in float64."""
+    x = centered(a).T @ centered(b)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x /= np.outer(norms[a], norms[b])
+    return np.clip(x, -1, 1, out=x)
+
+
+def _pair_correlation64(
+    centered: Callable[[np.ndarray | slice], np.ndarray],
+    norms: np.ndarray,
+    a: np.ndarray,
+    b: np.ndarray,
+    chunk_size: int = 1024,
+) -> np.ndarray:
+    """Pearson correlation of the column pairs (a, b), computed in float64."""
+    cor = np.empty(len(a))
+    for start in range(0, len(a), chunk_size):
+        i, j = a[start : start + chunk_size], b[start : start + chunk_size]
+        cor[start : start + chunk_size] = np.einsum("ij,ij->j", centered(i), centered(j))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cor /= norms[a] * norms[b]
+    return np.clip(cor, -1, 1, out=cor)
+
+
+def get_blocked_correlation(
+    values: np.ndarray, threshold: float, block_size: int = 512, tol: float = 1e-4,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find the pairs above a Pearson correlation threshold without a d x d matrix.
+
+    Standardized columns are multiplied in float32, one block of block_size
+    features at a time against the features that follow it, and only the
+    pairs above the threshold are kept. Pairs within tol of the threshold are
+    recomputed in float64, as are the absolute correlation sums of paired
+    features that are within tol * sqrt(d) of each other, so the result
+    matches the float64 correlation matrix.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        n x d matrix of finite values
+    threshold : float
+        Correlation above which a pair is returned
+    block_size : int, default 512
+        Number of features per block
+    tol : float, default 1e-4
+        Bound on the float32 error of a correlation
+
+    Returns
+    -------
+    abs_sums : numpy.ndarray
+        Sum of the absolute correlations of every feature, NaN skipped
+    pair_a, pair_b : numpy.ndarray
+        Feature positions of the pairs, with pair_b < pair_a
+
+    """
+    n, d = values.shape
+    mean = values.mean(axis=0, dtype=np.float64)
+
+    def centered(cols: np.ndarray | slice) -> np.ndarray:
+        return values[:, cols].astype(np.float64) - mean[cols]
+
+    # Unit norm columns, constant ones become NaN like in np.corrcoef
+    norms = np.empty(d)
+    z = np.empty((n, d), dtype=np.float32)
+    for start in range(0, d, block_size):
+        cols = slice(start, start + block_size)
+        x = centered(cols)
+        norms[cols] = np.sqrt((x * x).sum(axis=0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z[:, cols] = x / norms[cols]
+
+    abs_sums = np.zeros(d)
+    pair_a, pair_b = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for start in range(0, d, block_size):
+        # Upper triangle blocks only, every one counts for its rows and columns
+        cor = z[:, start : start + block_size].T @ z[:, start:]
+        size = len(cor)
+        abs_cor = np.abs(cor)
+        abs_sums[start : start + size] += np.nansum(abs_cor, axis=1, dtype=np.float64)
+        abs_sums[start + size :] += np.nansum(abs_cor[:, size:], axis=0, dtype=np.float64)
+
+        # Recheck the pairs close to the threshold in float64
+        cor[np.arange(cor.shape[1]) <= np.arange(size)[:, None]] = np.nan
+        b, a = np.nonzero(cor > threshold - tol)
+        a, b = a + start, b + start
+        keep = cor[b - start, a - start] > threshold + tol
+        close = ~keep
+        keep[close] = _pair_correlation64(centered, norms, a[close], b[close]) > threshold
+        pair_a.append(a[keep])
+        pair_b.append(b[keep])
+
+    pair_a, pair_b = np.concatenate(pair_a), np.concatenate(pair_b)
+
+    # Exact sums where float32 could swap the order of a pair
+    close = np.abs(abs_sums[pair_a] - abs_sums[pair_b]) <= tol * np.sqrt(d)
+    refine = np.unique(np.concatenate([pair_a[close], pair_b[close]]))
+    if len(refine):
+        sums = np.zeros(len(refine))
+        for start in range(0, d, block_size):
+            cols = np.arange(start, min(start + block_size, d))
+            sums += np.nansum(np.abs(_correlation64(centered, norms, refine, cols)), axis=1)
+        abs_sums[refine] = sums
+
+    return abs_sums, pair_a, pair_b
+
+
+def correlation_threshold(
+    population_df, features="infer", samples="all", threshold=0.9, method="pearson", *, block_size: int = 512,
+):
+    """Exclude features that have correlations above a certain threshold
+
+    Parameters
+    ----------
+    population_df : pandas.core.frame.DataFrame
+        DataFrame that includes metadata and observation features.
+    features : list, default "infer"
+         List of features present in the population dataframe [default: "infer"]
+         if "infer", then assume cell painting features are those that start with
+         "Cells_", "Nuclei_", or "Cytoplasm_".
+    samples : list or str, default "all"
+        List of samples to perform operation on. If "all", use all samples to calculate.
+    threshold - float, default 0.9
+        Must be between (0, 1) to exclude features
+    method - str, default "pearson"
+        indicating which correlation metric to use to test cutoff
+    block_size : int, default 512
+        Number of features per block of the pearson correlation of finite data
+
+    Returns
+    -------
+    excluded_features : list of str
+         List of features to exclude from the population_df.
+    """
+
+
+    assert 0 <= threshold <= 1, "threshold variable must be between (0 and 1)"
+
+    # Subset dataframe and calculate correlation matrix across subset features
+    if samples != "all":
+        population_df = population_df.loc[samples, :]
+
+    population_df = population_df.loc[:, features]
+    features = population_df.columns
+
+    values = population_df.to_numpy()
+    if method == "pearson" and np.isfinite(values).all():
+        abs_sums, pair_a, pair_b = get_blocked_correlation(values, threshold, block_size=block_size)
+    else:
+        # Get correlation matrix and lower triangle of pairwise correlations in long format
+        data_cor_df, pairwise_df = get_pairwise_correlation(
+            population_df=population_df, method=method
+        )
+        abs_sums = data_cor_df.abs().sum().to_numpy()
+        pairwise_df = pairwise_df.query("correlation > @threshold")
+        pair_a = features.get_indexer(pairwise_df["pair_a"])
+        pair_b = features.get_indexer(pairwise_df["pair_b"])
+
+    # Return an empty list if nothing is over correlation threshold
+    if len(pair_a) == 0:
+        return []
+
+    # Get absolute sum of correlation across features
+    # The lower the rank, the less correlation to the full data frame
+    # We want to drop features with highest correlation, so drop higher rank
+    order = pd.Series(abs_sums, index=features).sort_values().index
+    rank = np.empty(len(features), dtype=np.int64)
+    rank[features.get_indexer(order)] = np.arange(len(features))
+
+    # Output the excluded features, the one of each pair with the higher rank
+    excluded = np.where(rank[pair_a] > rank[pair_b], pair_a, pair_b)
+    return features[np.unique(excluded)].tolist()
@@ -1,35 +1,97 @@
+import hashlib
+import json
 import logging
+import os
+from pathlib import Path
 
 import pandas as pd
-from pycytominer.operations import correlation_threshold, variance_threshold
 
+from preprocessing.io import file_sha256, profile_columns, read_profiles, write_profiles
+
+from .correlation_threshold import correlation_threshold
 from .metadata import find_feat_cols
+from .variance_threshold import variance_threshold
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def select_features(dframe_path, feat_thresh, feat_selected_path):
-    '''Run feature selection'''
+def plan_key(dframe_path: str, **params: float) -> str:
+    """Hash the input file and the selection parameters."""
+    key = json.dumps({"input": file_sha256(dframe_path), **params}, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
 
-    dframe = pd.read_parquet(dframe_path)
+def make_plan(
+    dframe: pd.DataFrame,
+    feat_thresh: float,
+    freq_cut: float = 0.05,
+    unique_cut: float = 0.01,
+    corr_thresh: float = 0.9,
+) -> dict:
+    """Find the features removed by feature selection."""
     features = find_feat_cols(dframe.columns)
 
     # Filter out features with low variance
-    low_variance = variance_threshold(dframe, features)
+    low_variance = variance_threshold(dframe, features, freq_cut=freq_cut, unique_cut=unique_cut)
     features = [f for f in features if f not in low_variance]
-    logger.info(f'{len(low_variance)} features removed by variance_threshold')
+    logger.info("%d features removed by variance_threshold", len(low_variance))
 
     # Filter out features where any value exceeds threshold
     too_large = [f for f in features if (dframe[f].abs() > feat_thresh).any()]
     features = [f for f in features if f not in too_large]
-    logger.info(f'{len(too_large)} features removed due to large values')
+    logger.info("%d features removed due to large values", len(too_large))
 
     # Removed highly correlated filters
-    high_corr = correlation_threshold(dframe, features)
+    high_corr = correlation_threshold(dframe, features, threshold=corr_thresh)
     features = [f for f in features if f not in high_corr]
-    logger.info(f'{len(high_corr)} features removed by correlation_threshold')
+    logger.info("%d features removed by correlation_threshold", len(high_corr))
+
+    # Features over feat_thresh are only left out of the correlation filter
+    return {"low_variance": low_variance, "too_large": too_large, "high_corr": high_corr}
+
+
+def select_features(
+    dframe_path: str,
+    feat_thresh: float,
+    feat_selected_path: str,
+    plan_dir: str | None = None,
+    *,
+    freq_cut: float = 0.05,
+    unique_cut: float = 0.01,
+    corr_thresh: float = 0.9,
+) -> None:
+    """Run feature selection.
+
+    With plan_dir, the removed features are saved there as a json plan named
+    by the hash of the input file and the thresholds. Workflows whose input
+    is byte-identical reuse the plan and only read the kept columns.
+    """
+    params = {
+        "feat_thresh": feat_thresh,
+        "freq_cut": freq_cut,
+        "unique_cut": unique_cut,
+        "corr_thresh": corr_thresh,
+    }
+    plan_path = None
+    if plan_dir is not None:
+        plan_path = Path(plan_dir) / f"{plan_key(dframe_path, **params)}.json"
 
-    dframe.drop(columns=low_variance + high_corr, inplace=True)
+    if plan_path is not None and plan_path.exists():
+        plan = json.loads(plan_path.read_text())
+        logger.info("Reusing feature selection plan %s", plan_path)
+        dropped = set(plan["low_variance"] + plan["high_corr"])
+        columns = [c for c in profile_columns(dframe_path) if c not in dropped]
+        dframe = read_profiles(dframe_path, columns=columns)
+    else:
+        dframe = pd.read_parquet(dframe_path)
+        plan = make_plan(dframe, **params)
+        dframe = dframe.drop(columns=plan["low_variance"] + plan["high_corr"])
+        if plan_path is not None:
+            # Written under a temporary name, concurrent workflows may share the plan
+            plan_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = plan_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps({**params, **plan}, indent=1))
+            tmp_path.replace(plan_path)
 
-    dframe.reset_index(drop=True).to_parquet(feat_selected_path)
\ No newline at end of file
+    write_profiles(dframe, feat_selected_path)
@@ -1,28 +1,201 @@
 from __future__ import annotations
 
+import hashlib
+from pathlib import Path
+from typing import TYPE_CHECKING
+
 import numpy as np
-import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
 from .metadata import find_feat_cols, find_meta_cols
 
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Sequence
+    from typing import Self
+
+    import pandas as pd
+
+# Storage policy of every profile written by the pipeline
+SORT_COLUMNS = ["Metadata_Plate", "Metadata_Compound"]
+ROW_GROUP_SIZE = 4096
+COMPRESSION = "zstd"
+COMPRESSION_LEVEL = 3
+
+
+def profile_columns(path: str) -> list[str]:
+    """Get the column names of a parquet file or hive-partitioned dataset."""
+    return ds.dataset(path, format="parquet", partitioning="hive").schema.names
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 24) -> str:
+    """Hash the bytes of a file, read in chunks of chunk_size bytes."""
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_profiles(path: str, columns: list[str] | None = None, filters: list | None = None) -> pd.DataFrame:
+    """Read a parquet file or hive-partitioned dataset.
+
+    Only the given columns are read. Filters use the pyarrow DNF format,
+    e.g. [("Metadata_Compound", "==", "DMSO")], and are pushed down to skip
+    partitions and row groups.
+    """
+    return pq.read_table(path, columns=columns, filters=filters).to_pandas()
+
+
+def table_to_matrix(table: pa.Table) -> np.ndarray:
+    """Copy the columns of an arrow table into a float32 matrix.
+
+    The matrix is column-major, so every column is one contiguous copy out of
+    its arrow buffers. Nulls become NaN.
+    """
+    vals = np.empty((table.num_rows, table.num_columns), dtype=np.float32, order="F")
+    for i, column in enumerate(table.itercolumns()):
+        start = 0
+        for chunk in column.chunks:
+            vals[start : start + len(chunk), i] = chunk.to_numpy(zero_copy_only=False)
+            start += len(chunk)
+    return vals
+
 
 def split_parquet(
     dframe_path: str,
-    features=None,
+    features: Sequence[str] | None = None,
+    filters: list | None = None,
 ) -> tuple[pd.DataFrame, np.ndarray, list[str]]:
-    dframe = pd.read_parquet(dframe_path)
+    """Read metadata as a DataFrame and features as a float32 matrix.
+
+    Only the metadata columns and the given features, all of them by
+    default, are read. Filters are passed to read_profiles.
+    """
+    columns = profile_columns(dframe_path)
+    if features is None:
+        features = find_feat_cols(columns)
+    meta_cols = find_meta_cols(columns)
+
+    table = pq.read_table(dframe_path, columns=meta_cols + list(features), filters=filters)
+    meta = table.select(meta_cols).to_pandas()
+    vals = table_to_matrix(table.select(features))
+    return meta, vals, list(features)
+
+
+def _plate_block(
+    batches: list[pa.RecordBatch], meta_cols: list[str], features: Sequence[str],
+) -> tuple[pd.DataFrame, np.ndarray]:
+    table = pa.Table.from_batches(batches)
+    return table.select(meta_cols).to_pandas(), table_to_matrix(table.select(features))
+
+
+def iter_plates(path: str, features: Sequence[str] | None = None) -> Iterator[tuple[pd.DataFrame, np.ndarray]]:
+    """Yield the metadata and float32 feature matrix of one plate at a time.
+
+    Rows are streamed in record batches and grouped into runs of the same
+    plate, so memory is bounded by the largest plate. Rows keep their order,
+    a plate whose rows are not contiguous is yielded once per run.
+    """
+    columns = profile_columns(path)
     if features is None:
-        features = find_feat_cols(dframe)
-    vals = np.empty((len(dframe), len(features)), dtype=np.float32)
-    for i, c in enumerate(features):
-        vals[:, i] = dframe[c]
-    meta = dframe[find_meta_cols(dframe)].copy()
-    return meta, vals, features
-
-
-def merge_parquet(meta, vals, features, output_path: str) -> None:
-    """Save the data in a parquet file resetting the index."""
-    dframe = pd.DataFrame(vals, columns=features)
-    for c in meta:
-        dframe[c] = meta[c].reset_index(drop=True)
-    dframe.to_parquet(output_path)
+        features = find_feat_cols(columns)
+    meta_cols = find_meta_cols(columns)
+
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    pending, plate = [], None
+    for batch in dataset.to_batches(columns=meta_cols + list(features)):
+        plates = batch.column("Metadata_Plate")
+        if pa.types.is_dictionary(plates.type):
+            plates = plates.dictionary_decode()
+        plates = plates.to_numpy(zero_copy_only=False)
+
+        bounds = np.flatnonzero(plates[1:] != plates[:-1]) + 1
+        for start, stop in zip([0, *bounds], [*bounds, len(plates)], strict=True):
+            if plates[start] != plate and pending:
+                yield _plate_block(pending, meta_cols, features)
+                pending = []
+            plate = plates[start]
+            pending.append(batch.slice(start, stop - start))
+
+    if pending:
+        yield _plate_block(pending, meta_cols, features)
+
+
+def _to_table(meta: pd.DataFrame, vals: np.ndarray, features: Sequence[str]) -> pa.Table:
+    """Build a table of float32 features followed by metadata, sorted by SORT_COLUMNS."""
+    keys = [c for c in SORT_COLUMNS if c in meta.columns]
+    if keys:
+        meta = meta.reset_index(drop=True)
+        ix = meta.sort_values(keys, kind="stable").index.to_numpy()
+        meta, vals = meta.iloc[ix], vals[ix]
+    arrays = [pa.array(vals[:, i].astype(np.float32, copy=False), from_pandas=True) for i in range(vals.shape[1])]
+    meta = pa.Table.from_pandas(meta, preserve_index=False)
+    return pa.Table.from_arrays(
+        arrays + meta.columns,
+        names=[str(f) for f in features] + meta.column_names,
+    )
+
+
+def _writer_options(table: pa.Table) -> dict:
+    # Repeated metadata strings are dictionary encoded, floats rarely repeat
+    return {
+        "compression": COMPRESSION,
+        "compression_level": COMPRESSION_LEVEL,
+        "use_dictionary": find_meta_cols(table.column_names),
+    }
+
+
+def merge_parquet(meta: pd.DataFrame, vals: np.ndarray, features: Sequence[str], output_path: str) -> None:
+    """Save float32 features followed by metadata in a parquet file.
+
+    The matrix columns are handed to arrow directly, NaN is stored as null.
+    Rows are sorted by plate and compound, so row group statistics let
+    filters on them skip row groups.
+    """
+    table = _to_table(meta, vals, features)
+    pq.write_table(table, output_path, row_group_size=ROW_GROUP_SIZE, **_writer_options(table))
+
+
+def write_profiles(dframe: pd.DataFrame, output_path: str) -> None:
+    """Save a DataFrame of profiles like merge_parquet."""
+    features = find_feat_cols(dframe.columns)
+    vals = dframe[features].to_numpy(dtype=np.float32)
+    merge_parquet(dframe[find_meta_cols(dframe.columns)], vals, features, output_path)
+
+
+class ProfileWriter:
+    """Append blocks of profiles, e.g. plates, to one parquet file.
+
+    Every block is written like merge_parquet writes a whole file and later
+    blocks are cast to the schema of the first one.
+    """
+
+    def __init__(self, output_path: str) -> None:
+        """Open nothing yet, the file is created by the first write."""
+        self.output_path = output_path
+        self._writer = None
+
+    def write(self, meta: pd.DataFrame, vals: np.ndarray, features: Sequence[str]) -> None:
+        """Append one block of profiles."""
+        table = _to_table(meta, vals, features)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.output_path, table.schema, **_writer_options(table))
+        elif not table.schema.equals(self._writer.schema):
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+
+    def close(self) -> None:
+        """Close the file, if any block was written."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self) -> Self:
+        """Use the writer as a context manager, closing it on exit."""
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        """Close the writer."""
+        self.close()
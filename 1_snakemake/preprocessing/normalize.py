@@ -1,46 +1,127 @@
+from __future__ import annotations
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import TYPE_CHECKING
+
 import numpy as np
 import pandas as pd
-import pycytominer
+from tqdm import tqdm
 
-from preprocessing.io import merge_parquet, split_parquet
+from preprocessing.io import (
+    ProfileWriter,
+    iter_plates,
+    merge_parquet,
+    profile_columns,
+    read_profiles,
+    split_parquet,
+)
 
+from .metadata import find_feat_cols
+from .sphering import Spherize
 
-def mad(variant_feats_path, neg_stats_path, normalized_path):
-    meta, vals, features = split_parquet(variant_feats_path)
-    neg_stats = pd.read_parquet(neg_stats_path)
-    neg_stats = neg_stats.query("feature in @features")
+if TYPE_CHECKING:
+    from collections.abc import Sequence
 
-    # get counts and sort by plate
-    plates, counts = np.unique(meta["Metadata_Plate"], return_counts=True)
-    ix = np.argsort(meta["Metadata_Plate"])
-    meta = meta.iloc[ix]
-    vals = vals[ix]
 
-    # get mad and median matrices for MAD normalization
+def plate_mad_stats(neg_stats: pd.DataFrame, features: Sequence[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Pivot the negative control stats to the median and mad of every plate."""
+    neg_stats = neg_stats.query("feature in @features")
+
+    # get mad and median per plate for MAD normalization
     mads = neg_stats.pivot(index="Metadata_Plate", columns="feature", values="mad")
-    mads = mads.loc[plates, features].values
+    mads = mads[features]
     medians = neg_stats.pivot(
         index="Metadata_Plate",
         columns="feature",
         values="median",
     )
-    medians = medians.loc[plates, features].values
+    medians = medians[features]
+    return medians, mads
 
-    # Get normalized features (epsilon = 0) for all plates that have MAD stats
-    # -= and /= are inplace operations. i.e save memory
-    vals -= np.repeat(medians, counts, axis=0)
-    vals /= np.repeat(mads, counts, axis=0)
 
-    merge_parquet(meta, vals, features, normalized_path)
+def mad_matrix(meta: pd.DataFrame, vals: np.ndarray, medians: pd.DataFrame, mads: pd.DataFrame) -> None:
+    """MAD normalize the rows of every plate inplace."""
+    for plate, ix in meta.groupby("Metadata_Plate", observed=True).indices.items():
+        plate_vals = vals[ix]
+        plate_vals -= medians.loc[plate].to_numpy()
+        plate_vals /= mads.loc[plate].to_numpy()
+        vals[ix] = plate_vals
 
 
-def spherize(input_path, normalized_path):
-    dframe = pd.read_parquet(input_path)
-    dframe = dframe.sample(frac=1.0)
-    dframe = pycytominer.normalize(
-        dframe,
-        image_features=True,
-        samples="Metadata_Compound == 'DMSO'",
-        method="spherize",
-    )
-    dframe.to_parquet(normalized_path)
+def mad(variant_feats_path: str, neg_stats_path: str, normalized_path: str) -> None:
+    """MAD normalize every plate with the stats of its negative controls.
+
+    Plates are read, normalized and appended to the output one at a time.
+    """
+    features = find_feat_cols(profile_columns(variant_feats_path))
+    medians, mads = plate_mad_stats(pd.read_parquet(neg_stats_path), features)
+
+    with ProfileWriter(normalized_path) as writer:
+        for meta, vals in iter_plates(variant_feats_path, features):
+            plate = meta["Metadata_Plate"].iloc[0]
+            # inplace operations, i.e save memory
+            np.subtract(vals, medians.loc[plate].to_numpy(), out=vals)
+            np.divide(vals, mads.loc[plate].to_numpy(), out=vals)
+            writer.write(meta, vals, features)
+
+
+def _spherize_group(
+    input_path: str, by: str, group: object, method: str, solver: str,
+) -> tuple[pd.DataFrame, np.ndarray, list[str]]:
+    """Spherize one group with a transform fitted on its DMSO wells."""
+    meta, vals, features = split_parquet(input_path, filters=[(by, "==", group)])
+    negcon = (meta["Metadata_Compound"] == "DMSO").to_numpy()
+    spherizer = Spherize(method=method, solver=solver).fit(vals[negcon])
+    return meta, spherizer.transform(vals).astype(np.float32), features
+
+
+def spherize(
+    input_path: str,
+    normalized_path: str,
+    model_path: str | None = None,
+    *,
+    method: str = "ZCA-cor",
+    solver: str = "auto",
+    by: str | None = None,
+    n_workers: int | None = None,
+) -> None:
+    """Spherize profiles with a transform fitted on the DMSO wells.
+
+    With model_path, a transform saved there by an earlier run is reused if
+    it exists, so new plates are transformed without refitting. Otherwise
+    the fitted transform is saved there.
+
+    With by, e.g. "Metadata_Plate" or "Metadata_Batch", every group gets its
+    own transform fitted on its own DMSO wells. Groups are read with pushdown
+    filters and fitted in a process pool, and each one is appended to the
+    output as soon as it is done. model_path is not used then.
+    """
+    if by is not None:
+        groups = read_profiles(input_path, columns=[by])[by].unique().tolist()
+        # arrow is multithreaded, so workers are spawned rather than forked
+        with (
+            ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as pool,
+            ProfileWriter(normalized_path) as writer,
+        ):
+            futures = [pool.submit(_spherize_group, input_path, by, g, method, solver) for g in groups]
+            for future in tqdm(as_completed(futures), total=len(futures), leave=False):
+                writer.write(*future.result())
+        return
+
+    meta, vals, features = split_parquet(input_path)
+
+    if model_path is not None and Path(model_path).exists():
+        spherizer = Spherize.load(model_path)
+        if spherizer.W.shape[0] != len(features):
+            msg = f"{model_path} was fitted on {spherizer.W.shape[0]} features, got {len(features)}"
+            raise ValueError(msg)
+    else:
+        negcon = (meta["Metadata_Compound"] == "DMSO").to_numpy()
+        spherizer = Spherize(method=method, solver=solver).fit(vals[negcon])
+        if model_path is not None:
+            spherizer.save(model_path)
+
+    vals = spherizer.transform(vals).astype(np.float32)
+    merge_parquet(meta, vals, features, normalized_path)
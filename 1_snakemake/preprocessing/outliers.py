@@ -1,33 +1,96 @@
+from __future__ import annotations
+
+import json
 import logging
+from typing import TYPE_CHECKING
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from sklearn.impute import KNNImputer, SimpleImputer
+from sklearn.metrics.pairwise import nan_euclidean_distances
+from tqdm.contrib.concurrent import thread_map
+
+from preprocessing.io import merge_parquet, profile_columns, split_parquet, table_to_matrix
 
-from preprocessing.io import merge_parquet, split_parquet
+from .metadata import find_feat_cols
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
 
 logger = logging.getLogger(__name__)
 
 
-def iqr(scale: float, normalized_path, stats_path, outlier_path):
+def iqr(scale: float, normalized_path, stats_path, outlier_path, *, streaming: bool = False):
+    """Find outliers beyond scale times the IQR of every feature.
+
+    Outliers are rare, so only their cells are saved as (row, col) pairs.
+    The feature names and number of rows are stored in the schema metadata.
+    With streaming the profiles are scanned in record batches.
+    """
     desc = pd.read_parquet(stats_path)
-    meta, vals, features = split_parquet(normalized_path)
+    features = find_feat_cols(profile_columns(normalized_path))
 
     cutoff = desc["iqr"] * scale
     lower, higher = desc["25%"] - cutoff, desc["75%"] + cutoff
     logger.info(f"Lowest/Highest threshold: {lower.min()}, {higher.min()}")
-    outliers = np.logical_or(vals < lower.values, vals > higher.values)
-    outliers = pd.DataFrame(outliers, columns=features)
-    for c in meta:
-        outliers[c] = meta[c]
-    outliers.to_parquet(outlier_path)
+    lower, higher = lower.values, higher.values
+
+    if streaming:
+        dataset = ds.dataset(normalized_path, format="parquet", partitioning="hive")
+        batches = (table_to_matrix(pa.Table.from_batches([b])) for b in dataset.to_batches(columns=features))
+    else:
+        batches = [split_parquet(normalized_path, features)[1]]
+
+    rows, cols, n_rows = [], [], 0
+    for vals in batches:
+        batch_rows, batch_cols = np.nonzero(np.logical_or(vals < lower, vals > higher))
+        rows.append(batch_rows + n_rows)
+        cols.append(batch_cols)
+        n_rows += len(vals)
+
+    table = pa.table({
+        "row": np.concatenate(rows).astype(np.int32),
+        "col": np.concatenate(cols).astype(np.int32),
+    })
+    table = table.replace_schema_metadata({
+        "features": json.dumps([str(f) for f in features]),
+        "n_rows": str(n_rows),
+    })
+    pq.write_table(table, outlier_path)
+
+
+def read_outlier_cells(outlier_path: str, features: Sequence[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Read the (row, col) outlier cells, with cols indexing the given features.
+
+    Outliers in features that are not given are skipped.
+    """
+    table = pq.read_table(outlier_path)
+    saved = json.loads(table.schema.metadata[b"features"])
+    position = {f: i for i, f in enumerate(features)}
+    col_map = np.array([position.get(f, -1) for f in saved], dtype=np.int64)
+
+    rows = table.column("row").to_numpy()
+    cols = col_map[table.column("col").to_numpy()]
+    keep = cols >= 0
+    return rows[keep], cols[keep]
+
+
+def read_outlier_mask(outlier_path: str, features: Sequence[str]) -> np.ndarray:
+    """Expand the outlier cells into a boolean mask of the given features."""
+    n_rows = int(pq.read_schema(outlier_path).metadata[b"n_rows"])
+    mask = np.zeros((n_rows, len(features)), dtype=bool)
+    mask[read_outlier_cells(outlier_path, features)] = True
+    return mask
 
 
 def drop_cols(normalized_path, outlier_path, drop_outliers_path):
     """Compute mAP dropping the columns with at least one outlier. It ignores DMSO."""
     meta, vals, features = split_parquet(normalized_path)
-    mask = pd.read_parquet(outlier_path)[features].values
-    no_outlier_cols = mask.sum(axis=0) == 0
+    _, cols = read_outlier_cells(outlier_path, features)
+    no_outlier_cols = np.bincount(cols, minlength=len(features)) == 0
     vals = vals[:, no_outlier_cols]
     features = np.asarray(features)[no_outlier_cols]
     merge_parquet(meta, vals, features, drop_outliers_path)
@@ -36,16 +99,15 @@ def drop_cols(normalized_path, outlier_path, drop_outliers_path):
 def clip_cols(normalized_path, outlier_path, clip_value, clip_outliers_path):
     """Compute mAP clipping values to a given magnitude. It ignores DMSO"""
     meta, vals, features = split_parquet(normalized_path)
-    mask = pd.read_parquet(outlier_path)[features].values
-    vals[mask] = np.clip(vals[mask], -clip_value, clip_value)
+    cells = read_outlier_cells(outlier_path, features)
+    vals[cells] = np.clip(vals[cells], -clip_value, clip_value)
     merge_parquet(meta, vals, features, clip_outliers_path)
 
 
 def impute_median(normalized_path, outlier_path, impute_median_path):
     """Impute outliers using median"""
     meta, vals, features = split_parquet(normalized_path)
-    mask = pd.read_parquet(outlier_path)[features].values
-    vals[mask] = np.nan
+    vals[read_outlier_cells(outlier_path, features)] = np.nan
 
     imputer = SimpleImputer(copy=False, strategy="median")
     imputer.fit_transform(vals)
@@ -53,13 +115,69 @@ def impute_median(normalized_path, outlier_path, impute_median_path):
     merge_parquet(meta, vals, features, impute_median_path)
 
 
-def impute_knn(normalized_path, outlier_path, impute_knn_path):
-    """Impute outliers using kNN."""
+def _impute_group(vals: np.ndarray, mask: np.ndarray, n_neighbors: int, block_size: int) -> None:
+    """Impute the masked cells of one group of rows inplace.
+
+    Only rows with masked cells are compared against the group, in blocks of
+    block_size rows, with the nan_euclidean distance of KNNImputer. Each
+    masked cell gets the mean of its n_neighbors closest rows that are not
+    masked in that column. As in KNNImputer, donors without a finite
+    distance get no weight, and cells without any such donor get the
+    column mean.
+    """
+    data = np.where(mask, np.float32(np.nan), vals)
+    targets = np.flatnonzero(mask.any(axis=1))
+    for start in range(0, len(targets), block_size):
+        rows = targets[start : start + block_size]
+        dist = nan_euclidean_distances(data[rows], data)
+        dist[np.isnan(dist)] = np.inf
+        for j in np.flatnonzero(mask[rows].any(axis=0)):
+            missing = np.flatnonzero(mask[rows, j])
+            donors = np.flatnonzero(~np.isnan(data[:, j]))
+            if len(donors) == 0:
+                continue
+            k = min(n_neighbors, len(donors))
+            d = dist[np.ix_(missing, donors)]
+            nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+            weights = np.isfinite(np.take_along_axis(d, nearest, axis=1))
+            n_finite = weights.sum(axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                imputed = (data[donors[nearest], j] * weights).sum(axis=1) / n_finite
+            # Rows without a finite distance to any donor
+            imputed[n_finite == 0] = data[donors, j].mean()
+            vals[rows[missing], j] = imputed
+
+
+def impute_knn(
+    normalized_path,
+    outlier_path,
+    impute_knn_path,
+    *,
+    by: str | None = None,
+    n_neighbors: int = 5,
+    block_size: int = 256,
+):
+    """Impute outliers using kNN.
+
+    With by, e.g. "Metadata_Plate" or "Metadata_Compound" for a compound's
+    concentration series, neighbours are searched within each group only and
+    only the outlier cells are imputed. Groups run in parallel.
+    """
     meta, vals, features = split_parquet(normalized_path)
-    mask = pd.read_parquet(outlier_path)[features].values
-    vals[mask] = np.nan
+    mask = read_outlier_mask(outlier_path, features)
 
-    imputer = KNNImputer(copy=False)
-    imputer.fit_transform(vals)
+    if by is None:
+        vals[mask] = np.nan
+        imputer = KNNImputer(copy=False, n_neighbors=n_neighbors)
+        imputer.fit_transform(vals)
+    else:
+        groups = [ix for ix in meta.groupby(by, observed=True).indices.values() if mask[ix].any()]
+
+        def impute(ix: np.ndarray) -> None:
+            group_vals = vals[ix]
+            _impute_group(group_vals, mask[ix], n_neighbors, block_size)
+            vals[ix] = group_vals
+
+        thread_map(impute, groups, leave=False)
 
     merge_parquet(meta, vals, features, impute_knn_path)
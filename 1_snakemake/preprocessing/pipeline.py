@@ -0,0 +1,49 @@
+"""Preprocessing chains that run on one in-memory matrix."""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from preprocessing.io import merge_parquet
+
+from .feature_selection import make_plan
+from .normalize import mad_matrix, plate_mad_stats
+from .stats import read_variant_features
+
+logger = logging.getLogger(__name__)
+
+
+def mad_featselect(
+    parquet_path: str,
+    health_path: str,
+    neg_stats_path: str,
+    feat_thresh: float,
+    featselect_path: str,
+    *,
+    variant_feats_path: str | None = None,
+    mad_path: str | None = None,
+) -> None:
+    """Select variant features, MAD normalize and run feature selection.
+
+    Same result as select_variant_features, mad and select_features, but the
+    float32 matrix is read once and only the selected profiles are written.
+    The variant_feats and mad intermediates are written only if their paths
+    are given.
+    """
+    meta, vals, features = read_variant_features(parquet_path, health_path, neg_stats_path)
+    if variant_feats_path is not None:
+        merge_parquet(meta, vals, features, variant_feats_path)
+
+    medians, mads = plate_mad_stats(pd.read_parquet(neg_stats_path), features)
+    mad_matrix(meta, vals, medians, mads)
+    if mad_path is not None:
+        merge_parquet(meta, vals, features, mad_path)
+
+    # The filters take a DataFrame, a view over the matrix avoids a copy
+    plan = make_plan(pd.DataFrame(vals, columns=features, copy=False), feat_thresh)
+    dropped = set(plan["low_variance"] + plan["high_corr"])
+    keep = np.array([f not in dropped for f in features], dtype=bool)
+    logger.info("%d of %d features selected", keep.sum(), len(features))
+
+    merge_parquet(meta.reset_index(drop=True), vals[:, keep], np.asarray(features)[keep], featselect_path)
@@ -0,0 +1,135 @@
+"""Mergeable sketches of feature statistics for data that does not fit in memory."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+
+class QuantileSketch:
+    """Approximate quantiles and exact moments of every column of a matrix.
+
+    Quantiles use a KLL-style compactor per level, shared by all columns:
+    level h holds rows of weight 2**h. When a level reaches k rows it is
+    sorted along the columns and every other row, from a random offset, is
+    promoted to the next level. The rank error is about 1/k. Count, mean,
+    variance, min and max are kept exactly. Sketches of e.g. row groups
+    can be merged in any order.
+    """
+
+    def __init__(self, n_cols: int, k: int = 1024, seed: int = 0) -> None:
+        """Start an empty sketch of n_cols columns, with k rows per level."""
+        self.n_cols = n_cols
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels: list[np.ndarray] = []
+        self.count = np.zeros(n_cols, dtype=np.int64)
+        self.mean = np.zeros(n_cols)
+        self.m2 = np.zeros(n_cols)
+        self.min = np.full(n_cols, np.nan)
+        self.max = np.full(n_cols, np.nan)
+
+    def _add_moments(self, count: np.ndarray, mean: np.ndarray, m2: np.ndarray) -> None:
+        # Chan et al. update of the mean and sum of squared deviations
+        total = self.count + count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta = mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0)
+            self.m2 = np.where(total > 0, self.m2 + m2 + delta**2 * self.count * count / total, 0)
+        self.count = total
+
+    def _compact(self) -> None:
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) >= self.k:
+                level = np.sort(level, axis=0)
+                n_pairs = len(level) // 2
+                offset = self.rng.integers(2)
+                promoted = level[offset : 2 * n_pairs : 2]
+                self.levels[h] = level[2 * n_pairs :]
+                if h + 1 == len(self.levels):
+                    self.levels.append(promoted)
+                else:
+                    self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def update(self, vals: np.ndarray) -> None:
+        """Add the rows of a matrix."""
+        vals = np.asarray(vals, dtype=np.float32)
+        finite = ~np.isnan(vals)
+        count = finite.sum(axis=0)
+        if not count.any():
+            return
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = vals.astype(np.float64)
+            mean = np.nansum(x, axis=0) / count
+            m2 = np.nansum((x - mean) ** 2, axis=0)
+        self._add_moments(count, np.nan_to_num(mean), m2)
+        self.min = np.fmin(self.min, np.fmin.reduce(x, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(x, axis=0))
+
+        if not self.levels:
+            self.levels.append(vals.copy())
+        else:
+            self.levels[0] = np.concatenate([self.levels[0], vals])
+        self._compact()
+
+    def merge(self, other: QuantileSketch) -> QuantileSketch:
+        """Add the rows summarized by another sketch."""
+        self._add_moments(other.count, other.mean, other.m2)
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        for h, level in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(level.copy())
+            else:
+                self.levels[h] = np.concatenate([self.levels[h], level])
+        self._compact()
+        return self
+
+    def quantiles(self, q: float | Sequence[float]) -> np.ndarray:
+        """Get approximate quantiles, with q in [0, 1], one row per quantile."""
+        q = np.atleast_1d(q)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0**h) for h, level in enumerate(self.levels)])
+
+        order = np.argsort(values, axis=0)
+        values = np.take_along_axis(values, order, axis=0)
+        weights = np.where(np.isnan(values), 0, weights[order])
+        cum_weights = np.cumsum(weights, axis=0)
+        # Every value stands for the ranks around the middle of its weight
+        centers = cum_weights - weights / 2
+        targets = q[:, None] * cum_weights[-1]
+        ix = np.stack([(centers < target).sum(axis=0) for target in targets])
+        ix = np.minimum(ix, len(values) - 1)
+        result = np.take_along_axis(values, ix, axis=0).astype(np.float64)
+        result[:, self.count == 0] = np.nan
+        return result
+
+    def describe(self, features: Sequence[str]) -> pd.DataFrame:
+        """Get the columns of DataFrame.describe for every feature."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            std = np.sqrt(self.m2 / (self.count - 1))
+        # Like pandas, the std of a single value is NaN
+        std[self.count <= 1] = np.nan
+        q25, q50, q75 = self.quantiles([0.25, 0.5, 0.75])
+        return pd.DataFrame(
+            {
+                "count": self.count.astype(np.float64),
+                "mean": np.where(self.count > 0, self.mean, np.nan),
+                "std": std,
+                "min": self.min,
+                "25%": q25,
+                "50%": q50,
+                "75%": q75,
+                "max": self.max,
+            },
+            index=pd.Index(features),
+        )
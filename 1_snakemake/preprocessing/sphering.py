@@ -0,0 +1,277 @@
+"""
+From https://github.com/shntnu/pycytominer/blob/e7ef835daac20813bb92e4bad28b0e79a60d368b/pycytominer/operations/transform.py
+
+Transform observation variables by specified groups.
+
+References
+----------
+.. [1] Kessy et al. 2016 "Optimal Whitening and Decorrelation" arXiv: https://arxiv.org/abs/1512.00809
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils.extmath import randomized_svd
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+class Spherize(BaseEstimator, TransformerMixin):
+    """Class to apply a sphering transform (aka whitening) data in the base sklearn
+    transform API. Note, this implementation is modified/inspired from the following
+    sources:
+    1) A custom function written by Juan C. Caicedo
+    2) A custom ZCA function at https://github.com/mwv/zca
+    3) Notes from Niranj Chandrasekaran (https://github.com/cytomining/pycytominer/issues/90)
+    4) The R package "whitening" written by Strimmer et al (http://strimmerlab.org/software/whitening/)
+    5) Kessy et al. 2016 "Optimal Whitening and Decorrelation" [1]_
+
+    Attributes
+    ----------
+    epsilon : float
+        fudge factor parameter
+    center : bool
+        option to center the input X matrix
+    method : str
+        a string indicating which class of sphering to perform
+    solver : str
+        a string indicating how the eigendecomposition is computed
+    """
+
+    def __init__(self, epsilon=1e-6, center=True, method="ZCA", solver="auto"):
+        """
+        Parameters
+        ----------
+        epsilon : float, default 1e-6
+            fudge factor parameter
+        center : bool, default True
+            option to center the input X matrix
+        method : str, default "ZCA"
+            a string indicating which class of sphering to perform
+        solver : str, default "auto"
+            "svd" for the thin SVD of X, "eigh" for the eigendecomposition of
+            the d x d covariance matrix, "randomized" for a truncated
+            randomized SVD of X or "auto" for "eigh" when n > d and "svd"
+            otherwise
+        """
+        avail_methods = ["PCA", "ZCA", "PCA-cor", "ZCA-cor"]
+        avail_solvers = ["auto", "svd", "eigh", "randomized"]
+
+        self.epsilon = epsilon
+        self.center = center
+
+        if method not in avail_methods:
+            raise ValueError(
+                f"Error {method} not supported. Select one of {avail_methods}")
+        self.method = method
+
+        if solver not in avail_solvers:
+            msg = f"Error {solver} not supported. Select one of {avail_solvers}"
+            raise ValueError(msg)
+        self.solver = solver
+
+        # PCA-cor and ZCA-cor require center=True
+        if self.method in ["PCA-cor", "ZCA-cor"] and not self.center:
+            raise ValueError("PCA-cor and ZCA-cor require center=True")
+
+    def _decompose(self, x: np.ndarray) -> tuple[np.ndarray, np.ndarray, float]:
+        """Get the singular values and right singular vectors of x.
+
+        Only the first min(n, d) singular vectors are returned, except for PCA
+        with n <= d, which needs a full basis of the d-dimensional space. The
+        last value is the relative tolerance used to compute the rank.
+        """
+        n, d = x.shape
+        full = n <= d and self.method in ["PCA", "PCA-cor"]
+        solver = self.solver
+        if solver == "auto":
+            solver = "eigh" if n > d else "svd"
+
+        if solver == "eigh":
+            # Eigenvalues of X^T X are the squared singular values of X. The
+            # gram matrix is accumulated in float64 over blocks of rows.
+            gram = np.zeros((d, d))
+            for start in range(0, n, 4096):
+                block = x[start:start + 4096].astype(np.float64)
+                gram += block.T @ block
+            eigvals, v = np.linalg.eigh(gram)
+            order = np.argsort(eigvals)[::-1][:d if full else min(n, d)]
+            s = np.sqrt(np.clip(eigvals[order], 0, None))
+            # Small singular values are only accurate to sqrt(eps)
+            return s, v[:, order].T, np.sqrt(np.finfo(np.float64).eps)
+
+        if solver == "randomized" and not full:
+            k = n - 1 if self.center and n <= d else min(n, d)
+            _, s, vt = randomized_svd(x, n_components=k, random_state=0)
+        else:
+            _, s, vt = np.linalg.svd(x, full_matrices=full)
+        return s, vt, np.finfo(x.dtype).eps
+
+    def fit(self, X, y=None):
+        """Identify the sphering transform given self.X
+
+        Parameters
+        ----------
+        X : pandas.core.frame.DataFrame or numpy.ndarray
+            dataframe to fit sphering transform, float32 data is kept in
+            float32
+
+        Returns
+        -------
+        self
+            With computed weights attribute
+        """
+        X = np.asarray(X)
+        dtype = np.float32 if X.dtype == np.float32 else np.float64
+        X = X.astype(dtype)
+
+        # Centering and scaling are stored as vectors, so they can be saved
+        self.mean_ = X.mean(axis=0) if self.center else np.zeros(X.shape[1], dtype=dtype)
+        self.scale_ = np.ones(X.shape[1], dtype=dtype)
+        if self.method in ["PCA-cor", "ZCA-cor"]:
+            # The projection matrix for PCA-cor and ZCA-cor is the same as the
+            # projection matrix for PCA and ZCA, respectively, on the standardized
+            # data. So, we first standardize the data, then compute the projection
+            variances = X.var(axis=0)
+            if np.any(variances == 0):
+                raise ValueError(
+                    "Divide by zero error, make sure low variance columns are removed"
+                )
+            self.scale_ = np.sqrt(variances)
+        X = (X - self.mean_) / self.scale_
+
+        # Get the number of observations and variables
+        n, d = X.shape
+
+        # Get the eigenvalues and eigenvectors of the covariance matrix
+        Sigma, Vt, tol = self._decompose(X)
+
+        # compute the rank of the matrix X like np.linalg.matrix_rank
+        r = int(np.sum(Sigma > Sigma.max(initial=0) * max(n, d) * tol))
+
+        # If n < d, then rank should be equal to n - 1 (if centered) or n (if not centered)
+        # If n >= d, then rank should be equal to d
+        if not ((r == d) | (self.center & (r == n - 1)) | (not self.center &
+                                                           (r == n))):
+            raise ValueError(
+                "Sphering is not supported when the data matrix X is not full rank."
+                "Check for linear dependencies in the data and remove them.")
+
+        if n <= d and r != n - 1:
+            error_msg = (
+                f"When n <= d, the rank should be n - 1 i.e. {n - 1} but it is {r}."
+                "the call to `np.linalg.svd` in `pycytominer.transform.Spherize`"
+            )
+            raise ValueError(error_msg)
+
+        if n <= d and self.method in ["ZCA", "ZCA-cor"]:
+            # Closed form of the ZCA rotation with the missing d - r singular
+            # values set to the r'th one, without the d x d basis:
+            # V diag(1 / s) V^T = V_r diag(1 / s_r) V_r^T + (I - V_r V_r^T) / s_r
+            vt_r = Vt[:r]
+            inv = 1 / (Sigma[:r] + self.epsilon)
+            fill = 1 / (Sigma[r - 1] + self.epsilon)
+            self.W = (vt_r.T * (inv - fill)) @ vt_r
+            self.W[np.diag_indices(d)] += fill
+            self.W *= np.sqrt(n - 1)
+            self.W = self.W.astype(dtype)
+            return self
+
+        # if n <= d then Sigma has shape (n,) so it will need to be expanded to
+        # d filled with the value r'th element of Sigma
+        if n <= d:
+            Sigma = np.concatenate((Sigma[0:r], np.repeat(Sigma[r - 1],
+                                                          d - r)))
+
+        Sigma = Sigma + self.epsilon
+
+        self.W = (Vt / Sigma[:, np.newaxis]).transpose() * np.sqrt(n - 1)
+
+        # If ZCA, perform additional rotation
+        if self.method in ["ZCA", "ZCA-cor"]:
+            # Note: There was previously a requirement r==d otherwise the
+            # ZCA transform would not be well defined. However, it later appeared
+            # that this requirement was not necessary.
+
+            self.W = self.W @ Vt
+
+        self.W = self.W.astype(dtype)
+
+        if self.W.shape[1] != X.shape[1]:
+            error_detail = (
+                f"The number of columns of W should be equal to that of X."
+                f"However, W has {self.W.shape[1]} columns, X has {X.shape[1]} columns."
+                f"the call to `np.linalg.svd` in `pycytominer.transform.Spherize`"
+            )
+            raise ValueError(error_detail)
+
+        return self
+
+    def transform(self, X, y=None):
+        """Perform the sphering transform
+
+        Parameters
+        ----------
+        X : pd.core.frame.DataFrame or numpy.ndarray
+            Profile dataframe to be transformed using the precompiled weights
+        y : None
+            Has no effect; only used for consistency in sklearn transform API
+
+        Returns
+        -------
+        numpy.ndarray
+            Spherized data, in the precision of the fit
+        """
+        X = np.asarray(X, dtype=self.W.dtype)
+        return ((X - self.mean_) / self.scale_) @ self.W
+
+    def save(self, path: str | Path) -> None:
+        """Save the fitted transform to a .npz file.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Output file
+
+        """
+        np.savez(
+            path,
+            W=self.W,
+            mean=self.mean_,
+            scale=self.scale_,
+            method=self.method,
+            solver=self.solver,
+            epsilon=self.epsilon,
+            center=self.center,
+        )
+
+    @classmethod
+    def load(cls, path: str | Path) -> Spherize:
+        """Load a transform saved with save.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            File written by save
+
+        Returns
+        -------
+        Spherize
+            The fitted transform
+
+        """
+        with np.load(path) as data:
+            spherizer = cls(
+                epsilon=float(data["epsilon"]),
+                center=bool(data["center"]),
+                method=str(data["method"]),
+                solver=str(data["solver"]),
+            )
+            spherizer.W = data["W"]
+            spherizer.mean_ = data["mean"]
+            spherizer.scale_ = data["scale"]
+        return spherizer
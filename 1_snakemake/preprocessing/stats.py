@@ -1,62 +1,199 @@
+from __future__ import annotations
+
 import logging
-from functools import partial
+import os
+import warnings
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
+from typing import TYPE_CHECKING
 
 import numpy as np
 import pandas as pd
-from scipy.stats import median_abs_deviation
+import pyarrow.dataset as ds
+from tqdm import tqdm
 from tqdm.contrib.concurrent import thread_map
 
-from preprocessing.io import merge_parquet
+from preprocessing.io import (
+    iter_plates,
+    merge_parquet,
+    profile_columns,
+    read_profiles,
+    split_parquet,
+    table_to_matrix,
+)
+
+from .metadata import find_feat_cols
+from .sketch import QuantileSketch
 
-from .metadata import find_feat_cols, find_meta_cols
+if TYPE_CHECKING:
+    from collections.abc import Sequence
 
 logger = logging.getLogger(__name__)
 
+# Features with abs_coef_var at most this in any plate are not variant
+MIN_ABS_COEF_VAR = 1e-3
+
+
+def describe_matrix(vals: np.ndarray, features: Sequence[str]) -> pd.DataFrame:
+    """Get the columns of DataFrame.describe for every column of a matrix.
+
+    All quantiles are computed with one percentile call over axis 0, columns
+    with NaN use nanpercentile. Values match describe up to float rounding.
+    """
+    x = vals.astype(np.float64)
+    finite = ~np.isnan(x)
+    count = finite.sum(axis=0)
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nansum(x, axis=0) / count
+        std = np.sqrt(np.nansum((x - mean) ** 2, axis=0) / (count - 1))
+
+        q = np.empty((3, x.shape[1]))
+        with_nan = ~finite.all(axis=0)
+        q[:, ~with_nan] = np.percentile(x[:, ~with_nan], [25, 50, 75], axis=0)
+        q[:, with_nan] = np.nanpercentile(x[:, with_nan], [25, 50, 75], axis=0)
+        lowest, highest = np.nanmin(x, axis=0), np.nanmax(x, axis=0)
+
+    std[count <= 1] = np.nan
+    return pd.DataFrame(
+        {
+            "count": count.astype(np.float64),
+            "mean": mean,
+            "std": std,
+            "min": lowest,
+            "25%": q[0],
+            "50%": q[1],
+            "75%": q[2],
+            "max": highest,
+        },
+        index=pd.Index(features),
+    )
+
 
 def get_feat_stats(dframe: pd.DataFrame, features=None):
     """Get statistics per each feature."""
     if features is None:
         features = find_feat_cols(dframe)
-    desc = thread_map(lambda x: dframe[x].describe(), features, leave=False)
-    desc = pd.DataFrame(desc)
+    desc = describe_matrix(dframe[features].to_numpy(dtype=np.float32), features)
     desc["iqr"] = desc["75%"] - desc["25%"]
     return desc
 
 
+def sketch_feat_stats(parquet_path: str, features: Sequence[str] | None = None, k: int = 1024) -> pd.DataFrame:
+    """Get approximate statistics per each feature without loading the data.
+
+    Every row group is summarized by a QuantileSketch in a thread pool and
+    merged, in row group order, as soon as it is done. At most two sketches
+    per worker are in flight, so memory does not grow with the number of
+    row groups. Count, mean, std, min and max are exact.
+    """
+    if features is None:
+        features = find_feat_cols(profile_columns(parquet_path))
+    dataset = ds.dataset(parquet_path, format="parquet", partitioning="hive")
+    row_groups = [rg for fragment in dataset.get_fragments() for rg in fragment.split_by_row_group()]
+
+    def sketch_row_group(i: int) -> QuantileSketch:
+        sketch = QuantileSketch(len(features), k=k, seed=i)
+        sketch.update(table_to_matrix(row_groups[i].to_table(columns=features)))
+        return sketch
+
+    sketch = QuantileSketch(len(features), k=k)
+    n_workers = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=n_workers) as pool, tqdm(total=len(row_groups), leave=False) as progress:
+        pending = deque()
+        for i in range(len(row_groups)):
+            pending.append(pool.submit(sketch_row_group, i))
+            if len(pending) >= 2 * n_workers:
+                sketch.merge(pending.popleft().result())
+                progress.update()
+        while pending:
+            sketch.merge(pending.popleft().result())
+            progress.update()
+
+    desc = sketch.describe(features)
+    desc["iqr"] = desc["75%"] - desc["25%"]
+    return desc
+
+
+def _sorted_median(sorted_vals: np.ndarray, count: np.ndarray) -> np.ndarray:
+    """Get the median of every column of a sorted matrix with NaNs last."""
+    cols = np.arange(sorted_vals.shape[1])
+    lo = sorted_vals[np.maximum(count - 1, 0) // 2, cols]
+    hi = sorted_vals[count // 2, cols]
+    median = (lo + hi) / 2
+    median[count == 0] = np.nan
+    return median
+
+
+def _block_stats(vals: np.ndarray) -> dict[str, np.ndarray]:
+    """Get the stats of every column of one plate.
+
+    Every column is sorted once for the median, min and max and once more
+    for the MAD. Medians are averaged in float64 and returned in the input
+    precision like pandas, the MAD is computed in the input precision like
+    scipy, and their ratio is taken in float64 as in the long stats table.
+    """
+    count = np.count_nonzero(~np.isnan(vals), axis=0)
+    sorted_vals = np.sort(vals, axis=0)
+    median = _sorted_median(sorted_vals.astype(np.float64, copy=False), count).astype(vals.dtype).astype(np.float64)
+
+    # MAD around the median in the input precision
+    deviation = np.abs(vals - _sorted_median(sorted_vals, count))
+    mad = _sorted_median(np.sort(deviation, axis=0), count).astype(np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        abs_coef_var = np.abs(mad / median)
+    abs_coef_var[~np.isfinite(abs_coef_var)] = 0
+
+    cols = np.arange(vals.shape[1])
+    return {
+        "count": count,
+        "mad": mad,
+        "max": sorted_vals[np.maximum(count - 1, 0), cols],
+        "median": median,
+        "min": sorted_vals[0],
+        "abs_coef_var": abs_coef_var,
+    }
+
+
 def get_plate_stats(dframe: pd.DataFrame):
-    mad_fn = partial(median_abs_deviation, nan_policy="omit", axis=0)
-    feat_cols = find_feat_cols(dframe)
-    dframe = dframe[feat_cols + ["Metadata_Plate"]]
-    median = dframe.groupby("Metadata_Plate", observed=True).median()
-    max_ = dframe.groupby("Metadata_Plate", observed=True).max()
-    min_ = dframe.groupby("Metadata_Plate", observed=True).min()
-    count = dframe.groupby("Metadata_Plate", observed=True).count()
-    mad = dframe.groupby("Metadata_Plate", observed=True).apply(mad_fn)
-    mad = pd.DataFrame(index=mad.index, data=np.stack(mad.values), columns=feat_cols)
-
-    median["stat"] = "median"
-    mad["stat"] = "mad"
-    min_["stat"] = "min"
-    max_["stat"] = "max"
-    count["stat"] = "count"
-
-    stats = pd.concat([median, mad, min_, max_, count])
-    stats.reset_index(inplace=True)
-    stats = stats.melt(id_vars=["Metadata_Plate", "stat"], var_name="feature")
-    stats = stats.pivot(index=["Metadata_Plate", "feature"], columns="stat", values="value")
-    stats.reset_index(inplace=True)
-    stats["abs_coef_var"] = (stats["mad"] / stats["median"]).fillna(0).abs().replace(np.inf, 0)
-    stats = stats.astype({
-        "min": np.float32,
-        "max": np.float32,
+    """Get count, mad, max, median and min of every feature per plate.
+
+    Rows are sorted by plate once and the stats of every plate are computed
+    on its contiguous block, in parallel across plates. The result has one
+    row per plate and feature, sorted by plate and feature.
+    """
+    feat_cols = sorted(find_feat_cols(dframe))
+    plates = dframe["Metadata_Plate"].astype("category").cat.remove_unused_categories()
+
+    # Sort once by plate, so that every plate is a contiguous block
+    codes = plates.cat.codes.to_numpy()
+    ix = np.argsort(codes, kind="stable")
+    vals = dframe[feat_cols].to_numpy()[ix]
+    bounds = np.searchsorted(codes[ix], np.arange(len(plates.cat.categories) + 1))
+    stats = thread_map(
+        lambda i: _block_stats(vals[bounds[i] : bounds[i + 1]]),
+        range(len(plates.cat.categories)),
+        leave=False,
+    )
+
+    dtypes = {
         "count": np.int32,
-        "median": np.float32,
         "mad": np.float32,
+        "max": np.float32,
+        "median": np.float32,
+        "min": np.float32,
         "abs_coef_var": np.float32,
-        "feature": "category",
+    }
+    return pd.DataFrame({
+        "Metadata_Plate": plates.cat.categories.repeat(len(feat_cols)).astype(plates.dtype),
+        "feature": pd.Categorical(np.tile(np.asarray(feat_cols, dtype=object), len(stats))),
+        **{
+            stat: np.concatenate([s[stat] for s in stats]).astype(dtype)
+            for stat, dtype in dtypes.items()
+        },
     })
-    return stats
 
 
 def remove_nan_infs_columns(dframe: pd.DataFrame) -> pd.DataFrame:
@@ -68,43 +205,112 @@ def remove_nan_infs_columns(dframe: pd.DataFrame) -> pd.DataFrame:
     return dframe[[c for c in dframe.columns if c not in redlist]]
 
 
-def compute_negcon_stats(parquet_path, neg_stats_path):
+def column_health(parquet_path: str, health_path: str) -> None:
+    """Scan every feature once and save a column health report.
+
+    Rows are streamed in runs of the same plate. The report has one row per
+    feature with its number of nan/inf values, whether its finite values
+    are constant and the plates where the MAD of the negative controls is
+    zero. Rows of a plate need not be contiguous, the negative controls are
+    gathered by plate before their MAD is computed.
+    """
+    features = find_feat_cols(profile_columns(parquet_path))
+    nonfinite = np.zeros(len(features), dtype=np.int64)
+    lowest = np.full(len(features), np.nan, dtype=np.float32)
+    highest = np.full(len(features), np.nan, dtype=np.float32)
+    negcon_vals = defaultdict(list)
+
+    for meta, vals in iter_plates(parquet_path, features):
+        finite = np.isfinite(vals)
+        nonfinite += len(vals) - np.count_nonzero(finite, axis=0)
+        finite_vals = np.where(finite, vals, np.float32(np.nan))
+        lowest = np.fmin(lowest, np.fmin.reduce(finite_vals, axis=0))
+        highest = np.fmax(highest, np.fmax.reduce(finite_vals, axis=0))
+
+        negcon = (meta["Metadata_Compound"] == "DMSO").to_numpy()
+        if negcon.any():
+            negcon_vals[meta["Metadata_Plate"].iloc[0]].append(vals[negcon])
+
+    mad_zero_plates = [[] for _ in features]
+    for plate, blocks in negcon_vals.items():
+        for i in np.flatnonzero(_block_stats(np.concatenate(blocks))["mad"] == 0):
+            mad_zero_plates[i].append(plate)
+
+    health = pd.DataFrame({
+        "feature": features,
+        "nonfinite": nonfinite,
+        "constant": ~(lowest < highest),
+        "mad_zero_plates": mad_zero_plates,
+    })
+    health.to_parquet(health_path)
+
+
+def compute_negcon_stats(parquet_path: str, health_path: str, neg_stats_path: str) -> None:
     """Create statistics of negative controls platewise for columns without nan/inf values only."""
-    logger.info("Loading data")
-    dframe = pd.read_parquet(parquet_path)
-    logger.info("Removing nan and inf columns")
-    dframe = remove_nan_infs_columns(dframe)
-    negcon = dframe.query('Metadata_Compound == "DMSO"')
+    health = pd.read_parquet(health_path)
+    feat_cols = health.loc[health["nonfinite"] == 0, "feature"].tolist()
+    logger.info("Loading negcon data")
+    negcon = read_profiles(
+        parquet_path,
+        columns=["Metadata_Plate", *feat_cols],
+        filters=[("Metadata_Compound", "==", "DMSO")],
+    )
     logger.info("computing stats for negcons")
     neg_stats = get_plate_stats(negcon)
     logger.info("stats done.")
     neg_stats.to_parquet(neg_stats_path)
 
 
-def select_variant_features(parquet_path, neg_stats_path, variant_feats_path):
-    """Filtered out features that have mad == 0 or abs_coef_var>1e-3 in any plate.
-    stats are computed using negative controls only.
+def read_variant_features(
+    parquet_path: str, health_path: str, neg_stats_path: str,
+) -> tuple[pd.DataFrame, np.ndarray, list[str]]:
+    """Read the metadata and variant features matrix, rows sorted by plate.
+
+    Variant features are finite, not constant, and have mad != 0 and
+    abs_coef_var > 1e-3 in every plate. stats are computed using negative
+    controls only.
     """
-    dframe = pd.read_parquet(parquet_path)
+    health = pd.read_parquet(health_path)
     neg_stats = pd.read_parquet(neg_stats_path)
 
-    # Select variant_features
-    neg_stats = neg_stats.query("mad!=0 and abs_coef_var>1e-3")
-    groups = neg_stats.groupby("Metadata_Plate", observed=True)["feature"]
-    variant_features = set.intersection(*groups.agg(set).tolist())
+    # Select finite, non constant features with mad != 0 in every plate
+    healthy = (
+        (health["nonfinite"] == 0)
+        & ~health["constant"]
+        & (health["mad_zero_plates"].map(len) == 0)
+    )
+    low_var = neg_stats.loc[neg_stats["abs_coef_var"] <= MIN_ABS_COEF_VAR, "feature"]
+    variant_features = set(health.loc[healthy, "feature"]) - set(low_var)
 
     # Select plates with variant features
-    neg_stats = neg_stats.query("feature in @variant_features")
-    dframe = dframe.query("Metadata_Plate in @neg_stats.Metadata_Plate")
+    plates = neg_stats.loc[neg_stats["feature"].isin(variant_features), "Metadata_Plate"].unique().tolist()
+
+    # Read only the variant features of those plates
+    meta, vals, variant_features = split_parquet(
+        parquet_path,
+        sorted(variant_features),
+        filters=[("Metadata_Plate", "in", plates)],
+    )
+
+    # Keep plates contiguous so that they can be streamed one at a time
+    ix = np.argsort(meta["Metadata_Plate"].to_numpy(), kind="stable")
+    return meta.iloc[ix], vals[ix], variant_features
+
 
-    # Filter features
-    variant_features = sorted(variant_features)
-    meta = dframe[find_meta_cols(dframe)]
-    vals = dframe[variant_features].values
+def select_variant_features(parquet_path: str, health_path: str, neg_stats_path: str, variant_feats_path: str) -> None:
+    """Filtered out features that have mad == 0 or abs_coef_var>1e-3 in any plate.
+    stats are computed using negative controls only.
+    """
+    meta, vals, variant_features = read_variant_features(parquet_path, health_path, neg_stats_path)
     merge_parquet(meta, vals, variant_features, variant_feats_path)
 
 
-def compute_stats(parquet_path, stats_path):
-    dframe = pd.read_parquet(parquet_path)
-    fea_stats = get_feat_stats(dframe)
+def compute_stats(parquet_path: str, stats_path: str, *, streaming: bool = False) -> None:
+    """Get statistics per each feature, approximate ones with streaming."""
+    if streaming:
+        fea_stats = sketch_feat_stats(parquet_path)
+    else:
+        _, vals, features = split_parquet(parquet_path)
+        fea_stats = describe_matrix(vals, features)
+        fea_stats["iqr"] = fea_stats["75%"] - fea_stats["25%"]
     fea_stats.to_parquet(stats_path)
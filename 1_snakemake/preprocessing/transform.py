@@ -1,6 +1,6 @@
 import numpy as np
 import scipy.stats as ss
-from tqdm.contrib.concurrent import thread_map
+from tqdm.contrib.concurrent import process_map
 
 from preprocessing.io import merge_parquet, split_parquet
 
@@ -30,11 +30,48 @@ def rank_int_array(array: np.ndarray, c: float = 3.0 / 8, stochastic: bool = Tru
     return ss.norm.ppf(x)
 
 
-def rank_int(normalized_path, rank_int_path):
+def rank_int_matrix(vals: np.ndarray, c: float = 3.0 / 8, *, stochastic: bool = True, seed: int = 0) -> np.ndarray:
+    """Perform rank_int_array on every column of a 2d numpy array at once.
+
+    Columns are ranked with axis-0 operations. Ties are broken by one
+    permutation of the rows shared by all columns, which is the permutation
+    rank_int_array draws for every column, so the output is the same. Ranks
+    are 1..n, so the normal quantiles are computed once and looked up.
+    Columns with NaN are all NaN, like scipy.stats.rankdata.
+    """
+    n = len(vals)
+    if stochastic:
+        ix = np.random.default_rng(seed=seed).permutation(n)
+        # Ordinal ranks of the shuffled rows, ties keep their shuffled order
+        order = np.argsort(vals[ix], axis=0, kind="stable")
+        shuffled_rank = np.empty(vals.shape, dtype=np.int64)
+        np.put_along_axis(shuffled_rank, order, np.arange(1, n + 1)[:, None], axis=0)
+        rank = np.empty_like(shuffled_rank)
+        rank[ix] = shuffled_rank
+        quantiles = ss.norm.ppf((np.arange(1, n + 1) - c) / (n - 2 * c + 1))
+        result = quantiles[rank - 1]
+    else:
+        rank = ss.rankdata(vals, method="average", axis=0)
+        result = ss.norm.ppf((rank - c) / (n - 2 * c + 1))
+
+    result[:, np.isnan(vals).any(axis=0)] = np.nan
+    return result
+
+
+def _rank_int_block(vals: np.ndarray) -> np.ndarray:
+    return rank_int_matrix(vals).astype(np.float32)
+
+
+def rank_int(normalized_path: str, rank_int_path: str, block_size: int = 256) -> None:
+    """Rank-based inverse normal transform of every feature.
+
+    Columns are transformed in blocks of block_size across a process pool.
+    """
     meta, vals, features = split_parquet(normalized_path)
 
-    def to_normal(i):
-        vals[:, i] = rank_int_array(vals[:, i]).astype(np.float32)
+    blocks = [vals[:, i : i + block_size] for i in range(0, vals.shape[1], block_size)]
+    blocks = process_map(_rank_int_block, blocks, chunksize=1, leave=False)
+    for i, block in zip(range(0, vals.shape[1], block_size), blocks, strict=True):
+        vals[:, i : i + block_size] = block
 
-    thread_map(to_normal, range(len(features)), leave=False)
     merge_parquet(meta, vals, features, rank_int_path)
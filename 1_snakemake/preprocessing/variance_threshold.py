@@ -0,0 +1,127 @@
+"""
+Remove variables with near-zero variance.
+Modified from caret::nearZeroVar()
+"""
+
+import numpy as np
+from tqdm.contrib.concurrent import thread_map
+
+
+def variance_threshold(
+    population_df, features="infer", samples="all", freq_cut=0.05, unique_cut=0.01, *, block_size: int = 64,
+):
+    """Exclude features that have low variance (low information content)
+
+    Parameters
+    ----------
+    population_df : pandas.core.frame.DataFrame
+        DataFrame that includes metadata and observation features.
+    features : list, default "infer"
+         List of features present in the population dataframe [default: "infer"]
+         if "infer", then assume cell painting features are those that start with
+         "Cells_", "Nuclei_", or "Cytoplasm_".
+    samples : list or str, default "all"
+        List of samples to perform operation on. If "all", use all samples to calculate.
+    freq_cut : float, default 0.05
+        Ratio (2nd most common feature val / most common). Must range between 0 and 1.
+        Remove features lower than freq_cut. A low freq_cut will remove features
+        that have large difference between the most common feature value and second most
+        common feature value. (e.g. this will remove a feature: [1, 1, 1, 1, 0.01, 0.01, ...])
+    unique_cut: float, default 0.01
+        Ratio (num unique features / num samples). Must range between 0 and 1.
+        Remove features less than unique cut. A low unique_cut will remove features
+        that have very few different measurements compared to the number of samples.
+    block_size : int, default 64
+        Number of features sorted together, blocks are processed in parallel.
+
+    Returns
+    -------
+    excluded_features : list of str
+         List of features to exclude from the population_df.
+
+    """
+
+    assert 0 <= freq_cut <= 1, "freq_cut variable must be between (0 and 1)"
+    assert 0 <= unique_cut <= 1, "unique_cut variable must be between (0 and 1)"
+
+    # Subset dataframe
+    if samples != "all":
+        population_df = population_df.loc[samples, :]
+
+    population_df = population_df.loc[:, features]
+    features = population_df.columns.tolist()
+    n = population_df.shape[0]
+
+    # Sort blocks of columns in parallel and measure the runs of equal values
+    blocks = [features[i:i + block_size] for i in range(0, len(features), block_size)]
+    stats = thread_map(
+        lambda block: calculate_run_stats(population_df[block].to_numpy()),
+        blocks,
+        leave=False,
+    )
+    n_unique = np.concatenate([s[0] for s in stats]) if stats else np.empty(0)
+    top_counts = np.concatenate([s[1] for s in stats], axis=1) if stats else np.empty((2, 0))
+
+    # Exclude features with extreme (defined by freq_cut ratio) common values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        freq = top_counts[1] / top_counts[0]
+    excluded_freq = (n_unique <= 1) | (freq < freq_cut)
+
+    # Exclude features with too many (defined by unique_ratio) values in common
+    excluded_unique = n_unique / n < unique_cut
+
+    excluded = excluded_freq | excluded_unique
+    excluded_features = [f for f, e in zip(features, excluded, strict=True) if e]
+    return excluded_features
+
+
+def calculate_run_stats(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Count unique values and the two largest value counts of every column.
+
+    Each column is sorted once, so equal values form runs whose lengths are
+    the value counts. NaNs are ignored, like in pandas.Series.value_counts.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        2d array with one feature per column
+
+    Returns
+    -------
+    n_unique : numpy.ndarray
+        Number of unique non-NaN values per column
+    top_counts : numpy.ndarray
+        Largest and second largest value count per column, 0 if missing
+
+    """
+    n, d = values.shape
+    top_counts = np.zeros((2, d), dtype=np.int64)
+    if n == 0:
+        return np.zeros(d, dtype=np.int64), top_counts
+
+    # One sorted column per row, so runs are contiguous in memory
+    values = np.sort(np.asfortranarray(values).T, axis=1)
+    valid = ~np.isnan(values)
+
+    # Cells that start a run of equal values
+    starts = np.ones((d, n), dtype=bool)
+    np.not_equal(values[:, 1:], values[:, :-1], out=starts[:, 1:])
+    starts &= valid
+    n_unique = starts.sum(axis=1)
+
+    # A run ends where the next one starts, or at the last non-NaN cell
+    flat = np.flatnonzero(starts)
+    col, pos = np.divmod(flat, n)
+    last = np.append(col[1:] != col[:-1], True)
+    stop = np.append(pos[1:], 0)
+    stop[last] = valid.sum(axis=1)[col[last]]
+    lengths = stop - pos
+
+    # The two longest runs are the last two after sorting by column and length
+    order = np.lexsort((lengths, col))
+    col, lengths = col[order], lengths[order]
+    top = np.flatnonzero(np.append(col[1:] != col[:-1], True))
+    top_counts[0, col[top]] = lengths[top]
+    second = top[(top > 0) & (col[top - 1] == col[top])]
+    top_counts[1, col[second]] = lengths[second - 1]
+    return n_unique, top_counts
@@ -1,3 +0,0 @@
-from .correlation_threshold import correlation_threshold
-from .variance_threshold import variance_threshold
-from .transform import Spherize
\ No newline at end of file
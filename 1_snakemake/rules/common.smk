@@ -10,9 +10,19 @@ scenario = config["workflow"]
 name = config["name"]
 
 # Rules 
+rule column_health:
+    input:
+        f"inputs/profiles/{features}/raw.parquet",
+    output:
+        f"outputs/{features}/{name}/profiles/column_health.parquet",
+    run:
+        pp.stats.column_health(*input, *output)
+
+
 rule compute_negcon_stats:
     input:
         f"inputs/profiles/{features}/raw.parquet",
+        f"outputs/{features}/{name}/profiles/column_health.parquet",
     output:
         f"outputs/{features}/{name}/profiles/neg_stats.parquet",
     run:
@@ -22,6 +32,7 @@ rule compute_negcon_stats:
 rule select_variant_feats:
     input:
         f"inputs/profiles/{features}/raw.parquet",
+        f"outputs/{features}/{name}/profiles/column_health.parquet",
         f"outputs/{features}/{name}/profiles/neg_stats.parquet",
     output:
         f"outputs/{features}/{name}/profiles/variant_feats.parquet",
@@ -34,8 +45,10 @@ rule compute_norm_stats:
         f"outputs/{features}/{name}/profiles/mad.parquet",
     output:
         f"outputs/{features}/{name}/profiles/norm_stats.parquet",
+    params:
+        streaming=config.get("stats_streaming", False),
     run:
-        pp.stats.compute_stats(*input, *output)
+        pp.stats.compute_stats(*input, *output, streaming=params.streaming)
 
 
 rule iqr_outliers:
@@ -44,5 +57,7 @@ rule iqr_outliers:
         f"outputs/{features}/{name}/profiles/norm_stats.parquet",
     output:
         f"outputs/{features}/{name}/profiles/outliers.parquet",
+    params:
+        streaming=config.get("stats_streaming", False),
     run:
-        pp.outliers.iqr(config["iqr_scale"], *input, *output)
\ No newline at end of file
+        pp.outliers.iqr(config["iqr_scale"], *input, *output, streaming=params.streaming)
\ No newline at end of file
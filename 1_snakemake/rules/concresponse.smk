@@ -12,13 +12,30 @@ rule compute_distances_R:
         treatment=config["treatment"],
         categories=",".join(config["categories"]),
         distances=config["distances_R"],
-    shell:
-        """
-        for method in {params.distances}; do
-            method_name=$(echo $method | tr -d '[],"') 
-            Rscript concresponse/compute_distances.R {input} outputs/{features}/{name}/distances/${{method_name}}.parquet {params.cover_var} {params.treatment} {params.categories} ${{method_name}}
-        done
-        """
+        model_dir=f"outputs/{features}/{name}/distance_models",
+        frozen=config.get("frozen_distance_models", False),
+    threads: config.get("distance_cores", 30)
+    run:
+        for method in params.distances:
+            output_file = f"outputs/{features}/{name}/distances/{method}.parquet"
+            if method in ("gmd", "cmd"):
+                # Python ports, without an Rscript process
+                cr.ap.calculate_distances(
+                    input[0],
+                    output_file,
+                    method,
+                    params.cover_var,
+                    params.treatment,
+                    categories=config["categories"],
+                    n_workers=threads,
+                    model_dir=params.model_dir,
+                    frozen=params.frozen,
+                )
+            else:
+                shell(
+                    "Rscript concresponse/compute_distances.R {input} {output_file} {params.cover_var} "
+                    "{params.treatment} {params.categories} {method}"
+                )
 
 rule compute_distances_python:
     input:
@@ -15,13 +15,37 @@ rule mad_normalize:
         pp.normalize.mad(*input, *output)
 
 
+rule knn_impute:
+    input:
+        f"outputs/{features}/{name}/profiles/mad.parquet",
+        f"outputs/{features}/{name}/profiles/outliers.parquet",
+    output:
+        f"outputs/{features}/{name}/profiles/mad_knn.parquet",
+    params:
+        by=config.get("knn_group", "Metadata_Plate"),
+    run:
+        pp.outliers.impute_knn(*input, *output, by=params.by)
+
+
+rule spherize:
+    input:
+        f"outputs/{features}/{name}/profiles/{{pipeline}}.parquet",
+    output:
+        f"outputs/{features}/{name}/profiles/{{pipeline}}_spherize.parquet",
+    params:
+        by=config.get("spherize_group", "Metadata_Plate"),
+    threads: 8
+    run:
+        pp.normalize.spherize(*input, *output, by=params.by, n_workers=threads)
+
+
 rule int:
     input:
         f"outputs/{features}/{name}/profiles/{{pipeline}}.parquet",
     output:
         f"outputs/{features}/{name}/profiles/{{pipeline}}_int.parquet",
     run:
-        pp.select_features(*input, *output)
+        pp.transform.rank_int(*input, *output)
 
 
 rule featselect:
@@ -31,5 +55,36 @@ rule featselect:
         f"outputs/{features}/{name}/profiles/{{pipeline}}_featselect.parquet",
     params:
         outlier_thresh=config["outlier_feat_thresh"],
+        plan_dir=f"outputs/{features}/feature_plans",
     run:
-        pp.select_features(*input, params.outlier_thresh, *output)
\ No newline at end of file
+        pp.select_features(*input, params.outlier_thresh, *output, plan_dir=params.plan_dir)
+
+
+if config.get("fused_preprocessing", False):
+    # Run variant_feats -> mad -> featselect on one in-memory matrix
+    ruleorder: mad_featselect_fused > featselect
+    ruleorder: mad_featselect_fused > mad_normalize
+    ruleorder: mad_featselect_fused > select_variant_feats
+
+    fused_outputs = {"featselect": f"outputs/{features}/{name}/profiles/mad_featselect.parquet"}
+    if config.get("fused_intermediates", False):
+        fused_outputs["variant_feats"] = f"outputs/{features}/{name}/profiles/variant_feats.parquet"
+        fused_outputs["mad"] = f"outputs/{features}/{name}/profiles/mad.parquet"
+
+    rule mad_featselect_fused:
+        input:
+            f"inputs/profiles/{features}/raw.parquet",
+            f"outputs/{features}/{name}/profiles/column_health.parquet",
+            f"outputs/{features}/{name}/profiles/neg_stats.parquet",
+        output:
+            **fused_outputs,
+        params:
+            outlier_thresh=config["outlier_feat_thresh"],
+        run:
+            pp.pipeline.mad_featselect(
+                *input,
+                params.outlier_thresh,
+                output.featselect,
+                variant_feats_path=output.get("variant_feats"),
+                mad_path=output.get("mad"),
+            )
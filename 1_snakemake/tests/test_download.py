@@ -0,0 +1,51 @@
+"""Tests of the resumable downloader."""  # noqa: CPY001, INP001
+# ruff: noqa: S101
+
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# download runs the AWS CLI through sh
+pytest.importorskip("sh")
+from download import MIB, LocalBackend, etag_matches
+
+
+def multipart_etag(data: bytes, part_size: int) -> str:
+    """Compute the S3 ETag of a multipart upload of data."""
+    parts = [data[i : i + part_size] for i in range(0, len(data), part_size)]
+    digests = b"".join(hashlib.md5(p).digest() for p in parts)  # noqa: S324
+    return f"{hashlib.md5(digests).hexdigest()}-{len(parts)}"  # noqa: S324
+
+
+def test_multipart_etag_detects_corruption(tmp_path: Path) -> None:
+    """A file with the size of the upload but one flipped byte does not match."""
+    data = np.random.default_rng(0).bytes(3 * MIB + 17)
+    etag = multipart_etag(data, 2 * MIB)
+    path = tmp_path / "plate.parquet"
+    path.write_bytes(data)
+    assert etag_matches(path, etag)
+
+    corrupt = bytearray(data)
+    corrupt[MIB] ^= 0xFF
+    path.write_bytes(bytes(corrupt))
+    assert not etag_matches(path, etag)
+
+
+def test_multipart_etag_unknown_part_size(tmp_path: Path) -> None:
+    """Without a candidate part size giving the number of parts, only the size is checked."""
+    data = np.random.default_rng(1).bytes(3 * MIB)
+    path = tmp_path / "plate.parquet"
+    path.write_bytes(data)
+    assert etag_matches(path, multipart_etag(data, MIB // 2))
+
+
+def test_local_prefix_is_a_directory(tmp_path: Path) -> None:
+    """A prefix without a trailing separator does not match sibling directories."""
+    for name in ["source_4/a/plate.parquet", "source_40/plate.parquet"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b"x")
+    backend = LocalBackend(str(tmp_path))
+    assert [o.key for o in backend.list_objects("source_4")] == ["source_4/a/plate.parquet"]
+    assert [o.key for o in backend.list_objects("source_4/")] == ["source_4/a/plate.parquet"]
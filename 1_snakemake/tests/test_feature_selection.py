@@ -0,0 +1,37 @@
+"""Tests of the feature selection filters."""  # noqa: CPY001, INP001
+# ruff: noqa: S101
+
+import numpy as np
+import pandas as pd
+from preprocessing.correlation_threshold import correlation_threshold
+from preprocessing.variance_threshold import variance_threshold
+
+
+def test_variance_threshold() -> None:
+    """Constant, rare-value and few-unique features are excluded."""
+    rng = np.random.default_rng(0)
+    n = 300
+    profiles = pd.DataFrame({
+        "Cells_Normal": rng.normal(size=n),
+        "Cells_Constant": np.ones(n),
+        "Cells_Rare": np.r_[np.ones(n - 2), 0.01, 0.01],
+        "Cells_Binary": np.tile([0.0, 1.0], n // 2),
+    })
+    excluded = variance_threshold(profiles, profiles.columns.tolist(), block_size=2)
+
+    assert excluded == ["Cells_Constant", "Cells_Rare", "Cells_Binary"]
+
+
+def test_correlation_threshold_blocks() -> None:
+    """One feature of every correlated pair is dropped, whatever the block size."""
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(100, 6))
+    profiles = pd.DataFrame(
+        np.hstack([base, base[:, :3] + rng.normal(scale=0.1, size=(100, 3))]),
+        columns=[f"Cells_F{i}" for i in range(9)],
+    )
+    features = profiles.columns.tolist()
+    blocked = correlation_threshold(profiles, features, threshold=0.9, block_size=4)
+
+    assert blocked == ["Cells_F0", "Cells_F2", "Cells_F7"]
+    assert blocked == correlation_threshold(profiles, features, threshold=0.9)
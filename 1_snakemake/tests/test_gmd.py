@@ -0,0 +1,38 @@
+"""Tests of the saved GMD models."""  # noqa: CPY001, INP001
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# concresponse imports copairs for mAP
+pytest.importorskip("copairs")
+from concresponse.gmd import DistanceModel, fit_or_load
+
+
+def fit_model() -> DistanceModel:
+    """Fit a model on random wells of two treatments."""
+    rng = np.random.default_rng(0)
+    vals = rng.normal(size=(50, 6))
+    return DistanceModel.fit(vals, [f"Cells_F{i}" for i in range(6)], 0.8, np.repeat(["DMSO", "cpd"], 25))
+
+
+def test_load_checks_fitted_arrays(tmp_path: Path) -> None:
+    """A saved model with changed parameters does not load."""
+    model = fit_model()
+    model.save(tmp_path / "model.npz")
+    np.testing.assert_array_equal(DistanceModel.load(tmp_path / "model.npz").chol, model.chol)
+
+    for key in ["mean", "scale", "rotation", "chol"]:
+        with np.load(tmp_path / "model.npz") as data:
+            saved = dict(data)
+        saved[key] = saved[key] * 1.01
+        np.savez(tmp_path / "changed.npz", **saved)
+        with pytest.raises(ValueError, match="fingerprint"):
+            DistanceModel.load(tmp_path / "changed.npz")
+
+
+def test_frozen_requires_model_path() -> None:
+    """A frozen fit without a saved model is rejected up front."""
+    with pytest.raises(ValueError, match="requires model_path"):
+        fit_or_load(np.zeros((4, 2)), ["Cells_F0", "Cells_F1"], 0.8, ["DMSO"] * 4, frozen=True)
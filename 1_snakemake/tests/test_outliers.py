@@ -0,0 +1,36 @@
+"""Tests of the outlier imputation."""  # noqa: CPY001, INP001
+
+import numpy as np
+from preprocessing.outliers import _impute_group
+
+
+def test_impute_group_skips_donors_without_distance() -> None:
+    """Donors sharing no feature with a masked row get no weight."""
+    rng = np.random.default_rng(0)
+    vals = rng.normal(size=(8, 4)).astype(np.float32)
+    expected = vals.copy()
+    mask = np.zeros(vals.shape, dtype=bool)
+    mask[0, 0] = True
+    # Only column 0 is left, so row 1 has no distance to row 0
+    mask[1, 1:] = True
+    expected[0, 0] = vals[2:, 0].mean()
+    expected[1, 1:] = vals[2:, 1:].mean(axis=0)
+
+    _impute_group(vals, mask, n_neighbors=7, block_size=1)
+
+    np.testing.assert_allclose(vals, expected, rtol=1e-6)
+
+
+def test_impute_group_without_any_distance() -> None:
+    """Masked rows without a distance to any donor get the column mean."""
+    vals = np.arange(12, dtype=np.float32).reshape(4, 3)
+    expected = vals.copy()
+    mask = np.zeros(vals.shape, dtype=bool)
+    mask[0, :2] = True
+    mask[1:, 2] = True
+    expected[0, :2] = vals[1:, :2].mean(axis=0)
+    expected[1:, 2] = vals[0, 2]
+
+    _impute_group(vals, mask, n_neighbors=2, block_size=4)
+
+    np.testing.assert_allclose(vals, expected)
@@ -0,0 +1,62 @@
+"""Tests of the sphering transform."""  # noqa: CPY001, INP001
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from preprocessing.normalize import spherize
+from preprocessing.sphering import Spherize
+
+
+def test_save_load_without_pickle(tmp_path: Path) -> None:
+    """A saved transform holds plain arrays and loads back unchanged."""
+    rng = np.random.default_rng(0)
+    vals = rng.normal(size=(200, 20)).astype(np.float32)
+    spherizer = Spherize(method="ZCA-cor", solver="eigh").fit(vals)
+    spherizer.save(tmp_path / "model.npz")
+
+    with np.load(tmp_path / "model.npz") as data:
+        assert all(data[k].dtype != object for k in data.files)  # noqa: S101
+    loaded = Spherize.load(tmp_path / "model.npz")
+
+    assert loaded.get_params() == spherizer.get_params()  # noqa: S101
+    np.testing.assert_array_equal(loaded.transform(vals), spherizer.transform(vals))
+
+
+def write_plates(path: Path) -> pd.DataFrame:
+    """Write two plates with their own feature distributions, sorted as ProfileWriter does."""
+    rng = np.random.default_rng(1)
+    profiles = pd.DataFrame({
+        "Metadata_Plate": np.repeat(["plate_1", "plate_2"], 60),
+        "Metadata_Compound": np.tile(np.repeat(["DMSO", "cpd"], 30), 2),
+        **{f"Cells_F{i}": rng.normal(loc=i, scale=i + 1, size=120).astype(np.float32) for i in range(5)},
+    })
+    profiles.to_parquet(path, index=False)
+    return profiles
+
+
+def test_spherize_by_plate(tmp_path: Path) -> None:
+    """Every plate is transformed with a fit on its own DMSO wells."""
+    profiles = write_plates(tmp_path / "profiles.parquet")
+    spherize(tmp_path / "profiles.parquet", tmp_path / "spherized.parquet", by="Metadata_Plate", n_workers=2)
+    spherized = pd.read_parquet(tmp_path / "spherized.parquet")
+
+    features = [c for c in profiles.columns if not c.startswith("Metadata")]
+    for plate, group in profiles.groupby("Metadata_Plate"):
+        negcon = (group["Metadata_Compound"] == "DMSO").to_numpy()
+        expected = Spherize(method="ZCA-cor").fit(group[features].to_numpy()[negcon]).transform(group[features])
+        result = spherized.loc[spherized["Metadata_Plate"] == plate, features].to_numpy()
+        np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_spherize_reuses_saved_model(tmp_path: Path) -> None:
+    """A transform saved by a first run is used as is by the next ones."""
+    write_plates(tmp_path / "profiles.parquet")
+    model_path = tmp_path / "model.npz"
+    spherize(tmp_path / "profiles.parquet", tmp_path / "fitted.parquet", model_path=model_path)
+    saved = model_path.stat().st_mtime_ns
+    spherize(tmp_path / "profiles.parquet", tmp_path / "frozen.parquet", model_path=model_path)
+
+    assert model_path.stat().st_mtime_ns == saved  # noqa: S101
+    frozen = pd.read_parquet(tmp_path / "frozen.parquet")
+    pd.testing.assert_frame_equal(frozen, pd.read_parquet(tmp_path / "fitted.parquet"))
@@ -0,0 +1,67 @@
+"""Tests of the per-plate negcon and feature statistics."""  # noqa: CPY001, INP001
+# ruff: noqa: S101
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from preprocessing.sketch import QuantileSketch
+from preprocessing.stats import column_health, compute_negcon_stats, sketch_feat_stats
+
+
+def interleaved_profiles(path: Path, n_rows: int = 40) -> None:
+    """Write two plates whose rows alternate, so every run is a single row."""
+    rng = np.random.default_rng(0)
+    plates = np.tile(["plate_1", "plate_2"], n_rows // 2)
+    profiles = pd.DataFrame({
+        "Metadata_Plate": plates,
+        "Metadata_Compound": np.tile(["DMSO", "DMSO", "cpd", "cpd"], n_rows // 4),
+        # Constant within the DMSO wells of plate_1 only
+        "Cells_Constant": np.where(plates == "plate_1", 1.0, rng.normal(size=n_rows)).astype(np.float32),
+        "Cells_Variable": rng.normal(size=n_rows).astype(np.float32),
+    })
+    profiles.to_parquet(path, index=False)
+
+
+def test_column_health_interleaved_plates(tmp_path: Path) -> None:
+    """The MAD is computed on whole plates, not on runs of rows."""
+    interleaved_profiles(tmp_path / "profiles.parquet")
+    column_health(tmp_path / "profiles.parquet", tmp_path / "health.parquet")
+    health = pd.read_parquet(tmp_path / "health.parquet").set_index("feature")
+
+    assert list(health.loc["Cells_Constant", "mad_zero_plates"]) == ["plate_1"]
+    assert list(health.loc["Cells_Variable", "mad_zero_plates"]) == []
+    assert (health["nonfinite"] == 0).all()
+    assert not health["constant"].any()
+
+
+def test_column_health_matches_negcon_stats(tmp_path: Path) -> None:
+    """Plates with a zero MAD are the same as in the negcon stats."""
+    interleaved_profiles(tmp_path / "profiles.parquet")
+    column_health(tmp_path / "profiles.parquet", tmp_path / "health.parquet")
+    compute_negcon_stats(tmp_path / "profiles.parquet", tmp_path / "health.parquet", tmp_path / "neg_stats.parquet")
+    neg_stats = pd.read_parquet(tmp_path / "neg_stats.parquet")
+    health = pd.read_parquet(tmp_path / "health.parquet").set_index("feature")
+
+    zero = neg_stats[neg_stats["mad"] == 0]
+    for feature, plates in health["mad_zero_plates"].items():
+        assert sorted(plates) == sorted(zero.loc[zero["feature"] == feature, "Metadata_Plate"].astype(str))
+
+
+def test_sketch_feat_stats_merges_in_row_group_order(tmp_path: Path) -> None:
+    """Merging while row groups are sketched matches merging all sketches at the end."""
+    vals = np.random.default_rng(0).normal(size=(6000, 3)).astype(np.float32)
+    features = ["Cells_F0", "Cells_F1", "Cells_F2"]
+    pq.write_table(pa.table(dict(zip(features, vals.T, strict=True))), tmp_path / "p.parquet", row_group_size=100)
+
+    expected = QuantileSketch(3, k=64)
+    for i, start in enumerate(range(0, len(vals), 100)):
+        sketch = QuantileSketch(3, k=64, seed=i)
+        sketch.update(vals[start : start + 100])
+        expected.merge(sketch)
+    expected = expected.describe(features)
+
+    desc = sketch_feat_stats(tmp_path / "p.parquet", features, k=64)
+    pd.testing.assert_frame_equal(desc.drop(columns="iqr"), expected)
@@ -1 +1,2 @@
+from . import image_index as image_index
 from . import umaps as umaps
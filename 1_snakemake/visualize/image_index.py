@@ -0,0 +1,81 @@
+"""Bulk lookup of image files in the image index."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+
+def _encode(column: pa.ChunkedArray) -> tuple[dict[str, int], np.ndarray]:
+    """Get the dictionary and the int codes of a dictionary-encoded column."""
+    if not pa.types.is_dictionary(column.type):
+        column = pc.dictionary_encode(column)
+    column = column.unify_dictionaries().combine_chunks() if column.num_chunks > 1 else column.chunk(0)
+    codes = {value: i for i, value in enumerate(column.dictionary.to_pylist())}
+    return codes, column.indices.to_numpy(zero_copy_only=False).astype(np.int64)
+
+
+class ImageIndex:
+    """Look up the image files of wells and sites.
+
+    The index written by 2E_format_image_index.py is loaded once and every
+    row gets an integer key made from the plate and well dictionary codes and
+    the site. The keys are sorted, so a lookup of many (plate, well, site)
+    keys is a binary search rather than a scan of the whole index.
+
+    """
+
+    def __init__(self, index_path: str) -> None:
+        """Load the index."""
+        self.table = pq.read_table(index_path)
+
+        self._plates, plate_codes = _encode(self.table.column("Metadata_Plate"))
+        self._wells, well_codes = _encode(self.table.column("Metadata_Well"))
+        sites = self.table.column("Metadata_Site").to_numpy().astype(np.int64)
+        self._n_sites = int(sites.max()) + 1 if len(sites) else 1
+
+        keys = self._key(plate_codes, well_codes, sites)
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    def _key(self, plates: np.ndarray, wells: np.ndarray, sites: np.ndarray) -> np.ndarray:
+        return (plates * len(self._wells) + wells) * self._n_sites + sites
+
+    def lookup(self, keys: Iterable[tuple[str, str, int]]) -> pl.DataFrame:
+        """Get all files of the given (plate, well, site) keys.
+
+        Returns
+        -------
+            pl.DataFrame: Index rows of the keys, in the order of the keys.
+            Keys that are not in the index are skipped.
+
+        """
+        plates, wells, sites = [], [], []
+        for plate, well, site in keys:
+            if plate in self._plates and well in self._wells and 0 <= site < self._n_sites:
+                plates.append(self._plates[plate])
+                wells.append(self._wells[well])
+                sites.append(site)
+
+        query = self._key(
+            np.array(plates, dtype=np.int64),
+            np.array(wells, dtype=np.int64),
+            np.array(sites, dtype=np.int64),
+        )
+        start = np.searchsorted(self._keys, query, side="left")
+        counts = np.searchsorted(self._keys, query, side="right") - start
+
+        # Expand each [start, start + count) range into row positions
+        offsets = np.repeat(start - np.cumsum(counts) + counts, counts)
+        rows = self._order[offsets + np.arange(counts.sum())]
+
+        files = pl.from_arrow(self.table.take(rows))
+        return files.with_columns(pl.col(pl.Categorical).cast(pl.Utf8))